@@ -0,0 +1,315 @@
+"""
+ベンチマーク用のGitHub / Jira代替HTTPサーバー
+
+合成データはリポジトリ番号・Issue番号から決定的に生成するため、
+規模を大きくしてもサーバー側のメモリはほとんど増えない。
+GET /__stats でエンドポイントごとのリクエスト数、POST /__reset でカウンタのリセットができる。
+"""
+import json
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# 合成データの基準時刻（リクエスト時点から相対的に配置する）
+HISTORY_DAYS = 180
+
+# GitHubのレート制限ヘッダーで返す上限（/__reset で残数が戻る。計測が予算切れで止まらない大きさにする）
+GITHUB_RATE_LIMIT = 100000
+
+def _iso(value):
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _jira_iso(value):
+    return value.strftime("%Y-%m-%dT%H:%M:%S.000+0000")
+
+def _parse_iso(value):
+    return datetime.strptime(value.replace("Z", ""), "%Y-%m-%dT%H:%M:%S")
+
+class SyntheticData:
+    """規模の設定から決定的に合成データを生成する"""
+
+    def __init__(self, repos, deployments_per_repo, pulls_per_repo, incidents_per_repo, jira_issues):
+        self.repos = repos
+        self.deployments_per_repo = deployments_per_repo
+        self.pulls_per_repo = pulls_per_repo
+        self.incidents_per_repo = incidents_per_repo
+        self.jira_issues = jira_issues
+        self.now = datetime.utcnow().replace(microsecond=0)
+
+    def _spread(self, index, total):
+        """index 番目の要素の作成日時（新しい順に HISTORY_DAYS 日へ等間隔で配置）"""
+        return self.now - timedelta(seconds=HISTORY_DAYS * 86400 * (index + 1) / (total + 1))
+
+    def repo(self, index):
+        name = f"repo-{index:05d}"
+        return {"id": index + 1, "name": name, "full_name": f"bench/{name}", "owner": {"login": "bench"}}
+
+    def deployment(self, repo_index, index):
+        return {
+            "id": repo_index * 1000000 + index,
+            "created_at": self._spread(index, self.deployments_per_repo),
+            "failed": (repo_index + index) % 7 == 0
+        }
+
+    def pull(self, repo_index, index):
+        merged_at = self._spread(index, self.pulls_per_repo)
+        merged = (repo_index + index) % 5 != 0
+        return {
+            "number": index + 1,
+            "created_at": merged_at - timedelta(hours=6 + (repo_index * 31 + index * 17) % 300),
+            "updated_at": merged_at,
+            "merged_at": merged_at if merged else None
+        }
+
+    def incident(self, repo_index, index):
+        closed_at = self._spread(index, self.incidents_per_repo)
+        return {
+            "number": 100000 + index,
+            "created_at": closed_at - timedelta(minutes=30 + (repo_index * 13 + index * 97) % 2000),
+            "closed_at": closed_at,
+            "updated_at": closed_at
+        }
+
+    def jira_issue(self, index):
+        created = self._spread(index, self.jira_issues)
+        resolved = created + timedelta(hours=4 + index % 400) if index % 3 else None
+        if resolved and resolved > self.now:
+            resolved = None
+        done_without_resolution = resolved is None and index % 11 == 0
+        return {
+            "key": f"BENCH{index % 5}-{index + 1}",
+            "fields": {
+                "project": {"key": f"BENCH{index % 5}"},
+                "created": _jira_iso(created),
+                "updated": _jira_iso(resolved or created + timedelta(days=index % 45)),
+                "resolutiondate": _jira_iso(resolved) if resolved else None,
+                "status": {"statusCategory": {"key": "done" if resolved or done_without_resolution else "new"}}
+            }
+        }
+
+class FakeServerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # ヘッダーと本文を別々に書き込むため、Nagleアルゴリズムによる遅延を避ける
+    disable_nagle_algorithm = True
+    data = None
+    stats = None
+    stats_lock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- 共通処理 ---
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _count(self, endpoint):
+        with self.stats_lock:
+            self.stats[endpoint] += 1
+
+    def _send_github_json(self, status, body, headers=None):
+        """実際のAPIと同じくレート制限のヘッダーを付けて返す"""
+        with self.stats_lock:
+            used = sum(count for endpoint, count in self.stats.items() if endpoint.startswith("github:"))
+        headers = dict(headers or {}, **{
+            "X-RateLimit-Limit": str(GITHUB_RATE_LIMIT),
+            "X-RateLimit-Remaining": str(max(0, GITHUB_RATE_LIMIT - used)),
+            "X-RateLimit-Reset": str(int(time.time()) + 3600),
+            "X-RateLimit-Resource": "core"
+        })
+        return self._send_json(status, body, headers)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _paginate(self, items_count, make_item, query, endpoint_path, per_page_default=30):
+        page = int(query.get("page", ["1"])[0])
+        per_page = int(query.get("per_page", [str(per_page_default)])[0])
+        start = (page - 1) * per_page
+        items = [make_item(i) for i in range(start, min(start + per_page, items_count))]
+        headers = {}
+        if start + per_page < items_count:
+            params = {key: values[0] for key, values in query.items()}
+            params["page"] = str(page + 1)
+            query_string = "&".join(f"{key}={value}" for key, value in params.items())
+            host = self.headers.get("Host")
+            headers["Link"] = f'<http://{host}{endpoint_path}?{query_string}>; rel="next"'
+        return items, headers
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/__stats":
+            with self.stats_lock:
+                return self._send_json(200, dict(self.stats))
+        if url.path.startswith("/rest/api/2/"):
+            return self._jira_get(url.path, query)
+        return self._github_get(url.path, query)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == "/__reset":
+            with self.stats_lock:
+                self.stats.clear()
+            return self._send_json(200, {})
+        if url.path == "/graphql":
+            return self._github_graphql(self._read_body())
+        if url.path == "/rest/api/2/search":
+            body = self._read_body()
+            query = {key: [str(value)] for key, value in body.items()}
+            return self._jira_get("/rest/api/2/search", query)
+        return self._send_json(404, {"message": "Not Found"})
+
+    # --- GitHub ---
+
+    def _repo_url(self, repo):
+        return f"http://{self.headers.get('Host')}/repos/{repo['full_name']}"
+
+    def _github_get(self, path, query):
+        if path == "/user":
+            self._count("github:user")
+            return self._send_github_json(200, {"login": "bench", "id": 1})
+
+        if path == "/user/repos":
+            self._count("github:repos")
+            def make_repo(i):
+                repo = self.data.repo(i)
+                return dict(repo, url=self._repo_url(repo))
+            items, headers = self._paginate(self.data.repos, make_repo, query, path)
+            return self._send_github_json(200, items, headers)
+
+        match = re.match(r"^/repos/bench/repo-(\d+)/(pulls|issues|deployments)$", path)
+        if not match:
+            return self._send_github_json(404, {"message": "Not Found"})
+        repo_index, resource = int(match.group(1)), match.group(2)
+        repo_url = self._repo_url(self.data.repo(repo_index))
+        self._count(f"github:{resource}")
+
+        if resource == "pulls":
+            def make_pull(i):
+                pull = self.data.pull(repo_index, i)
+                # 一覧APIは merged を返さない（実際のAPIと同じ）
+                return {
+                    "number": pull["number"],
+                    "url": f"{repo_url}/pulls/{pull['number']}",
+                    "state": "closed",
+                    "created_at": _iso(pull["created_at"]),
+                    "updated_at": _iso(pull["updated_at"]),
+                    "merged_at": _iso(pull["merged_at"]) if pull["merged_at"] else None
+                }
+            items, headers = self._paginate(self.data.pulls_per_repo, make_pull, query, path)
+            return self._send_github_json(200, items, headers)
+
+        if resource == "issues":
+            since = _parse_iso(query["since"][0]) if "since" in query else None
+            count = self.data.incidents_per_repo
+            if since is not None:
+                # 新しい順に並んでいるため since 以降の件数だけを返す
+                count = sum(1 for i in range(count) if self.data.incident(repo_index, i)["updated_at"] >= since)
+            def make_issue(i):
+                incident = self.data.incident(repo_index, i)
+                return {
+                    "number": incident["number"],
+                    "url": f"{repo_url}/issues/{incident['number']}",
+                    "state": "closed",
+                    "labels": [{"name": "incident"}],
+                    "created_at": _iso(incident["created_at"]),
+                    "closed_at": _iso(incident["closed_at"]),
+                    "updated_at": _iso(incident["updated_at"])
+                }
+            items, headers = self._paginate(count, make_issue, query, path)
+            return self._send_github_json(200, items, headers)
+
+        def make_deployment(i):
+            deployment = self.data.deployment(repo_index, i)
+            return {
+                "id": deployment["id"],
+                "url": f"{repo_url}/deployments/{deployment['id']}",
+                "created_at": _iso(deployment["created_at"]),
+                "updated_at": _iso(deployment["created_at"])
+            }
+        items, headers = self._paginate(self.data.deployments_per_repo, make_deployment, query, path)
+        headers["ETag"] = f'"deployments-{repo_index}-{self.data.deployments_per_repo}"'
+        return self._send_github_json(200, items, headers)
+
+    def _github_graphql(self, body):
+        self._count("github:graphql")
+        variables = body.get("variables", {})
+        repo_index = int(variables["name"].split("-")[1])
+        start = int(variables.get("cursor") or 0)
+        end = min(start + variables["first"], self.data.deployments_per_repo)
+        nodes = []
+        for i in range(start, end):
+            deployment = self.data.deployment(repo_index, i)
+            nodes.append({
+                "databaseId": deployment["id"],
+                "createdAt": _iso(deployment["created_at"]),
+                "statuses": {"nodes": [{"state": "FAILURE" if deployment["failed"] else "SUCCESS"}]}
+            })
+        connection = {
+            "pageInfo": {"hasNextPage": end < self.data.deployments_per_repo, "endCursor": str(end)},
+            "nodes": nodes
+        }
+        return self._send_github_json(200, {"data": {"repository": {"deployments": connection}}})
+
+    # --- Jira ---
+
+    def _jira_get(self, path, query):
+        if path == "/rest/api/2/field":
+            # jira クライアントはフィールド名の対応表を最初に1回取得する
+            self._count("jira:field")
+            fields = ["project", "created", "updated", "resolutiondate", "status"]
+            return self._send_json(200, [{"id": field, "key": field, "name": field} for field in fields])
+        if path == "/rest/api/2/myself":
+            self._count("jira:myself")
+            return self._send_json(200, {"name": "bench"})
+        if path != "/rest/api/2/search":
+            return self._send_json(404, {"errorMessages": ["Not Found"]})
+
+        jql = query.get("jql", [""])[0]
+        if jql.startswith("key in"):
+            # 変更履歴の展開（完了済みで解決日時のないIssue向け）
+            self._count("jira:changelog")
+            keys = [key.strip() for key in jql[jql.index("(") + 1:jql.rindex(")")].split(",")]
+            issues = []
+            for key in keys:
+                issue = self.data.jira_issue(int(key.split("-")[1]) - 1)
+                issues.append({
+                    "key": key,
+                    "fields": {"status": issue["fields"]["status"]},
+                    "changelog": {"histories": [
+                        {"created": issue["fields"]["updated"], "items": [{"field": "status"}]}
+                    ]}
+                })
+            return self._send_json(200, {"startAt": 0, "maxResults": len(issues), "total": len(issues), "issues": issues})
+
+        self._count("jira:search")
+        start_at = int(query.get("startAt", ["0"])[0])
+        max_results = int(query.get("maxResults", ["50"])[0])
+        total = self.data.jira_issues
+        issues = [self.data.jira_issue(i) for i in range(start_at, min(start_at + max_results, total))]
+        return self._send_json(200, {"startAt": start_at, "maxResults": max_results, "total": total, "issues": issues})
+
+def serve(port_queue, repos, deployments_per_repo, pulls_per_repo, incidents_per_repo, jira_issues):
+    """別プロセスで起動し、待ち受けポートを port_queue に返す"""
+    handler = type("Handler", (FakeServerHandler,), {
+        "data": SyntheticData(repos, deployments_per_repo, pulls_per_repo, incidents_per_repo, jira_issues),
+        "stats": Counter(),
+        "stats_lock": threading.Lock()
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
@@ -0,0 +1,252 @@
+"""
+GitHub / Jira メトリクス計算のベンチマーク
+
+ローカルの代替サーバー（benchmarks/fake_servers.py）に合成データを用意し、
+規模ごとに各計算の実行時間・上流へのリクエスト数・ピークメモリを計測する。
+保存済みのベースラインより悪化した場合は終了コード1で終了する。
+
+    python -m benchmarks.run_benchmarks --scales 10,100,1000
+    python -m benchmarks.run_benchmarks --scales 10,100 --update-baseline
+"""
+import argparse
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from urllib.request import Request, urlopen
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module
+from app import create_app, db
+from models import User
+from benchmarks.fake_servers import serve
+from services import event_store, github_service, sync_service
+from services.github_service import GitHubService
+from services.jira_service import JiraService
+from services.sync_service import sync_and_compute_metrics
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+class FakeServer:
+    """代替サーバーを別プロセスで起動する（計測対象プロセスのメモリに影響させない）"""
+
+    def __init__(self, **scale):
+        context = multiprocessing.get_context("spawn")
+        port_queue = context.Queue()
+        self.process = context.Process(target=serve, args=(port_queue,), kwargs=scale, daemon=True)
+        self.process.start()
+        self.url = f"http://127.0.0.1:{port_queue.get(timeout=30)}"
+
+    def reset(self):
+        urlopen(Request(f"{self.url}/__reset", data=b"{}", method="POST")).read()
+
+    def stats(self):
+        return json.loads(urlopen(f"{self.url}/__stats").read())
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+
+def measure(server, func, repeat, setup=None):
+    """
+    実行時間（repeat回の最小値）・リクエスト数・ピークメモリを計測
+    setup があれば毎回の実行前に呼ぶ（計測には含めない）
+    """
+    wall_times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        server.reset()
+        gc.collect()
+        started = time.perf_counter()
+        result = func()
+        wall_times.append(time.perf_counter() - started)
+    requests = sum(server.stats().values())
+
+    # tracemalloc は実行を遅くするため、メモリは別の実行で計測する
+    if setup:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, {
+        "wall_time": round(min(wall_times), 4),
+        "requests": requests,
+        "peak_memory": peak
+    }
+
+def run_scale(scale, args):
+    server = FakeServer(
+        repos=scale,
+        deployments_per_repo=args.deployments_per_repo,
+        pulls_per_repo=args.pulls_per_repo,
+        incidents_per_repo=args.incidents_per_repo,
+        jira_issues=scale * args.jira_issues_per_repo
+    )
+    try:
+        github_service.GITHUB_API_URL = server.url
+        os.environ["JIRA_SERVER_URL"] = server.url
+
+        # プールのクライアント生成とトークン検証は計測に含めない
+        github = GitHubService(f"bench-{scale}", max_workers=args.workers)
+        jira = JiraService(f"bench-{scale}")
+
+        end_date = datetime.utcnow()
+        start_date = end_date - timedelta(days=args.window_days)
+        results = {}
+
+        (events, _), results["github.crawl"] = measure(
+            server, lambda: github._crawl_events(start_date, end_date), args.repeat
+        )
+        calculators = {
+            "github.deployment_frequency": GitHubService._get_deployment_frequency,
+            "github.lead_time": GitHubService._get_lead_time,
+            "github.change_failure_rate": GitHubService._get_change_failure_rate,
+            "github.time_to_restore": GitHubService._get_time_to_restore
+        }
+        for name, calculator in calculators.items():
+            _, results[name] = measure(
+                server, lambda calculator=calculator: calculator(events, start_date, end_date), args.repeat
+            )
+        _, results["github.four_keys"] = measure(
+            server, lambda: github.get_four_keys_metrics(args.window_days), args.repeat
+        )
+        _, results["jira.metrics"] = measure(
+            server, lambda: jira.get_metrics(args.window_days), args.repeat
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            results.update(run_store_cases(server, scale, args, os.path.join(directory, "bench.db")))
+        return results
+    finally:
+        server.stop()
+
+def run_store_cases(server, scale, args, database_path):
+    """
+    ローカルストアを使う計算を一時的な SQLite で計測
+    - sync.*.initial: 空のストアへの同期（バックフィルを含む）と計算
+    - sync.*.incremental: 同期済みのストアへの差分同期と計算
+    - store.*.compute_metrics: 保存済みのイベントからの計算（上流へのリクエストなし）
+    """
+    app_module.DATABASE_URL = f"sqlite:///{database_path}"
+    # 直前に同期したリポジトリも取得し直し、差分同期の経路を計測する
+    sync_service.REPO_SYNC_INTERVAL = 0
+    app = create_app()
+
+    def reset_store():
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        user = User(
+            username="bench", email="bench@example.com",
+            github_token=f"bench-{scale}", jira_token=f"bench-{scale}"
+        )
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+    results = {}
+    with app.app_context():
+        user_id = reset_store()
+        for source in ("github", "jira"):
+            _, results[f"sync.{source}.initial"] = measure(
+                server, lambda source=source: sync_and_compute_metrics(user_id, source, args.window_days, record=False),
+                args.repeat, setup=reset_store
+            )
+            _, results[f"sync.{source}.incremental"] = measure(
+                server, lambda source=source: sync_and_compute_metrics(user_id, source, args.window_days, record=False),
+                args.repeat
+            )
+            _, results[f"store.{source}.compute_metrics"] = measure(
+                server, lambda source=source: event_store.compute_metrics(user_id, source, args.window_days), args.repeat
+            )
+        db.session.remove()
+    return results
+
+def compare(results, baseline, time_tolerance, memory_tolerance, min_time_slack, min_memory_slack):
+    """ベースラインより悪化した項目を返す"""
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        if current["requests"] > previous["requests"]:
+            regressions.append(f"{key}: requests {previous['requests']} -> {current['requests']}")
+        time_limit = max(previous["wall_time"] * (1 + time_tolerance), previous["wall_time"] + min_time_slack)
+        if current["wall_time"] > time_limit:
+            regressions.append(f"{key}: wall time {previous['wall_time']}s -> {current['wall_time']}s")
+        memory_limit = max(previous["peak_memory"] * (1 + memory_tolerance), previous["peak_memory"] + min_memory_slack)
+        if current["peak_memory"] > memory_limit:
+            regressions.append(f"{key}: peak memory {previous['peak_memory']} -> {current['peak_memory']} bytes")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GitHub and Jira metric calculation against fake servers")
+    parser.add_argument("--scales", default="10,100", help="comma separated repository counts")
+    parser.add_argument("--deployments-per-repo", type=int, default=120)
+    parser.add_argument("--pulls-per-repo", type=int, default=150)
+    parser.add_argument("--incidents-per-repo", type=int, default=10)
+    parser.add_argument("--jira-issues-per-repo", type=int, default=20)
+    parser.add_argument("--window-days", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=None, help="GitHubService max_workers")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--time-tolerance", type=float, default=0.5)
+    parser.add_argument("--memory-tolerance", type=float, default=0.5)
+    parser.add_argument("--min-time-slack", type=float, default=0.05, help="seconds always allowed on top of the baseline")
+    parser.add_argument("--min-memory-slack", type=int, default=1024 * 1024, help="bytes always allowed on top of the baseline")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    # app の import で設定された DEBUG のログ出力を置き換える
+    logging.basicConfig(level=logging.WARNING, force=True)
+    logging.getLogger("services").setLevel(logging.ERROR)
+
+    results = {}
+    for scale in [int(value) for value in args.scales.split(",")]:
+        for name, result in run_scale(scale, args).items():
+            key = f"{scale}:{name}"
+            results[key] = result
+            print(f"{key:<36} {result['wall_time']:>9.4f}s {result['requests']:>7} req {result['peak_memory'] / 1024:>10.1f} KiB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found, skipping regression check")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(
+        results, baseline, args.time_tolerance, args.memory_tolerance, args.min_time_slack, args.min_memory_slack
+    )
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+import logging
+import click
+from app import db
+from models import User
+from services import batch_metrics
+
+logger = logging.getLogger(__name__)
+
+def register_commands(app):
+    @app.cli.command('compute-metrics')
+    @click.option('--user', 'users', multiple=True, help='User ID or username (repeatable, default: all users)')
+    @click.option('--source', 'sources', multiple=True, type=click.Choice(batch_metrics.SOURCES),
+                  help='Metric source (repeatable, default: github and jira)')
+    @click.option('--window-days', type=int, default=30, show_default=True)
+    @click.option('--workers', type=int, default=batch_metrics.DEFAULT_BATCH_WORKERS, show_default=True,
+                  help='Number of worker processes')
+    @click.option('--flush-size', type=int, default=batch_metrics.DEFAULT_BATCH_FLUSH_SIZE, show_default=True,
+                  help='Users per bulk write and checkpoint update')
+    @click.option('--checkpoint', 'checkpoint_path', default=batch_metrics.DEFAULT_CHECKPOINT_PATH, show_default=True,
+                  help='Progress file used to resume an interrupted run')
+    @click.option('--restart', is_flag=True, help='Ignore an existing checkpoint and start over')
+    def compute_metrics(users, sources, window_days, workers, flush_size, checkpoint_path, restart):
+        """
+        全ユーザー（または指定したユーザー）のメトリクスを計算し、Metric に保存します
+        夜間のバックフィルなど、ダッシュボードを開く前に計算しておく場合に使う
+        """
+        query = User.query.order_by(User.id)
+        if users:
+            ids = [int(user) for user in users if user.isdigit()]
+            names = [user for user in users if not user.isdigit()]
+            query = query.filter(db.or_(User.id.in_(ids), User.username.in_(names)))
+        user_ids = [user_id for (user_id,) in query.with_entities(User.id)]
+        if users and not user_ids:
+            raise click.ClickException(f"No users matched: {', '.join(users)}")
+
+        click.echo(f"Computing metrics for {len(user_ids)} users with {workers} workers")
+        try:
+            result = batch_metrics.run_batch(
+                user_ids,
+                sources=sources or batch_metrics.SOURCES,
+                window_days=window_days,
+                workers=workers,
+                checkpoint_path=checkpoint_path,
+                flush_size=flush_size,
+                restart=restart,
+                selection=sorted(user_ids) if users else "all"
+            )
+        except ValueError as e:
+            raise click.ClickException(f"{str(e)}; pass --restart to discard it or use another --checkpoint")
+        click.echo(f"Computed {result['computed']} users, skipped {result['skipped']} already computed")
+        if result["failed"]:
+            raise click.ClickException(
+                f"Failed for {len(result['failed'])} users (run again to resume): "
+                + ", ".join(str(user_id) for user_id in result["failed"])
+            )
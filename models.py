@@ -21,6 +21,10 @@ class User(UserMixin, db.Model):
         return check_password_hash(self.password_hash, password)
 
 class Metric(db.Model):
+    __table_args__ = (
+        db.Index('ix_metric_user_type_timestamp', 'user_id', 'metric_type', 'timestamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     metric_type = db.Column(db.String(50), nullable=False)
@@ -28,6 +32,95 @@ class Metric(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     source = db.Column(db.String(50), nullable=False)
 
+class MetricRollup(db.Model):
+    """Metric の日次・週次の集計値（履歴グラフ用）"""
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'source', 'metric_type', 'granularity', 'bucket_start', name='uq_metric_rollup'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    source = db.Column(db.String(50), nullable=False)
+    metric_type = db.Column(db.String(50), nullable=False)
+    granularity = db.Column(db.String(10), nullable=False)  # day or week
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    count = db.Column(db.Integer, default=0, nullable=False)
+    total = db.Column(db.Float, default=0, nullable=False)
+    minimum = db.Column(db.Float)
+    maximum = db.Column(db.Float)
+
+class SourceEvent(db.Model):
+    """GitHub / Jira から取り込んだ生イベント（リポジトリやプロジェクト単位で共有）"""
+    __table_args__ = (
+        db.UniqueConstraint('source', 'scope', 'event_type', 'external_id', name='uq_source_event'),
+        db.Index('ix_source_event_scope_type_created', 'scope', 'event_type', 'created_at'),
+        db.Index('ix_source_event_scope_type_resolved', 'scope', 'event_type', 'resolved_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(20), nullable=False)  # github or jira
+    scope = db.Column(db.String(255), nullable=False)  # repository full name or Jira project key
+    event_type = db.Column(db.String(30), nullable=False)  # deployments, pull_requests, incidents, issues
+    external_id = db.Column(db.String(100), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    resolved_at = db.Column(db.DateTime)  # merged_at, closed_at or resolutiondate
+    updated_at = db.Column(db.DateTime)
+    failed = db.Column(db.Boolean, default=False, nullable=False)
+    status = db.Column(db.String(50))
+
+class EventSketch(db.Model):
+    """スコープ・日ごとの所要時間の分位点スケッチ（リードタイム・復旧時間）"""
+    __table_args__ = (
+        db.UniqueConstraint('source', 'scope', 'metric_type', 'day', name='uq_event_sketch'),
+        db.Index('ix_event_sketch_type_day', 'metric_type', 'day'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(20), nullable=False)
+    scope = db.Column(db.String(255), nullable=False)
+    metric_type = db.Column(db.String(50), nullable=False)
+    day = db.Column(db.DateTime, nullable=False)
+    data = db.Column(db.Text, nullable=False)  # DurationSketch.to_json()
+
+class ScopeDailyStats(db.Model):
+    """スコープ（リポジトリ）の日ごとのメトリクスの中間集計（ユーザー間で共有し、集計期間は読み出し時に選ぶ）"""
+    __table_args__ = (
+        db.UniqueConstraint('source', 'scope', name='uq_scope_daily_stats'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(20), nullable=False)
+    scope = db.Column(db.String(255), nullable=False)
+    from_day = db.Column(db.DateTime, nullable=False)  # 集計済みの最初の日
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    data = db.Column(db.Text, nullable=False)  # DailyBuckets.to_json()
+
+class SyncWatermark(db.Model):
+    """ソース・スコープ・イベント種別ごとの同期済み位置"""
+    __table_args__ = (
+        db.UniqueConstraint('source', 'scope', 'resource', name='uq_sync_watermark'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(20), nullable=False)
+    scope = db.Column(db.String(255), nullable=False)
+    resource = db.Column(db.String(30), nullable=False)
+    high_water_mark = db.Column(db.DateTime, nullable=False)
+    etag = db.Column(db.String(255))
+    synced_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ScopeAccess(db.Model):
+    """ユーザーが参照できるリポジトリ / Jiraプロジェクト"""
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'source', 'scope', name='uq_scope_access'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    source = db.Column(db.String(20), nullable=False)
+    scope = db.Column(db.String(255), nullable=False)
+    checked_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class DashboardPreference(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
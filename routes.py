@@ -1,21 +1,183 @@
+import os
+import time
+import queue
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
-import markdown
 from flask import (
     render_template, redirect, url_for, flash,
-    request, jsonify, current_app as app
+    request, jsonify, g, Response, current_app as app
 )
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash
 from app import db
 from models import User, DashboardPreference
+from services import event_store, metric_history, webhook_service
+from services.instrumentation import registry, request_profiler
+from services.metrics_broadcaster import metrics_broadcaster
+from services.metrics_cache import metrics_cache
+from services.markdown_preview import markdown_renderer, preview_documents, PreviewOutOfSync
 from services.github_service import GitHubService
 from services.jira_service import JiraService
+from services.sync_service import sync_and_compute_metrics
 
 logger = logging.getLogger(__name__)
 
+# ダッシュボードに表示するメトリクスの集計日数
+METRICS_WINDOW_DAYS = 30
+
+# ストリームの接続維持のためにコメント行を送る間隔（秒）
+STREAM_HEARTBEAT_SECONDS = 15
+
+METRIC_SOURCES = ('github', 'jira')
+
+def _publish_metrics(key, metrics):
+    """再計算されたダッシュボードのメトリクスを、そのユーザーの開いているすべてのタブへ配信"""
+    user_id, source, window_days = key
+    if window_days == METRICS_WINDOW_DAYS:
+        metrics_broadcaster.publish(user_id, {'source': source, 'metrics': metrics})
+
+metrics_cache.add_listener(_publish_metrics)
+
+def _format_event(message):
+    return f"event: metrics\ndata: {json.dumps(message)}\n\n"
+
+def metrics_ttl(user):
+    """キャッシュのTTLはダッシュボード設定の更新間隔に合わせる"""
+    preferences = user.dashboard_preferences
+    return preferences.refresh_interval if preferences and preferences.refresh_interval else 300
+
+def get_cached_metrics(user, source, window_days=METRICS_WINDOW_DAYS):
+    """ユーザーのメトリクスをキャッシュ経由で取得します"""
+    return metrics_cache.get(
+        (user.id, source, window_days), metrics_ttl(user), _metrics_computation(user.id, source, window_days)
+    )
+
+def get_dashboard_metrics(user, source):
+    """
+    ダッシュボードの初期表示用に、計算を待たずにメトリクスを返します
+    キャッシュに無ければバックグラウンドで計算を開始し、終わり次第ストリームで配信する
+    それまでは最後に記録した値（無ければ空欄）を表示する
+    """
+    key = (user.id, source, METRICS_WINDOW_DAYS)
+    metrics = metrics_cache.get_nowait(key, metrics_ttl(user), _metrics_computation(user.id, source, METRICS_WINDOW_DAYS))
+    if metrics is not None:
+        return metrics
+
+    service = GitHubService if source == 'github' else JiraService
+    latest = metric_history.get_latest_values(user.id, source)
+    metrics = service._get_empty_metrics()
+    for metric_type, metric in metrics.items():
+        metric["value"] = latest.get(metric_type)
+    metrics["loading"] = True
+    return metrics
+
+def _metrics_computation(user_id, source, window_days):
+    # バックグラウンドで計算されるため、リクエストに依存しない値だけを閉じ込める
+    flask_app = app._get_current_object()
+
+    def compute():
+        # ローカルストアを差分同期し、保存済みのイベントから計算する
+        with flask_app.app_context():
+            return sync_and_compute_metrics(user_id, source, window_days)
+
+    return compute
+
+def refresh_scope_metrics(source, scope):
+    """
+    Webhookで更新されたスコープを参照するユーザーのキャッシュ済みメトリクスを、保存済みのデータから再計算します
+    上流への同期は行わず、結果はストリームで配信される
+    """
+    flask_app = app._get_current_object()
+    user_ids = set(event_store.get_scope_users(source, scope))
+    for key in metrics_cache.keys():
+        user_id, key_source, window_days = key
+        if key_source != source or user_id not in user_ids:
+            continue
+
+        def compute(key=key, user_id=user_id, window_days=window_days):
+            with flask_app.app_context():
+                metrics = event_store.compute_metrics(user_id, source, window_days)
+            # 同期の状況は変わらないため、前回の計算の値を引き継ぐ
+            previous = metrics_cache.peek(key)
+            if previous and "freshness" in previous:
+                metrics["freshness"] = previous["freshness"]
+            return metrics
+
+        metrics_cache.refresh(key, compute)
+
 def register_routes(app):
+    @app.before_request
+    def start_request_timer():
+        g.request_started = g.profile_started = time.perf_counter()
+        g.profiler = request_profiler.start(request.endpoint, request.args.get('profile') == '1')
+
+    @app.after_request
+    def record_request_duration(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        registry.observe(
+            "http_request_duration_seconds", time.perf_counter() - started,
+            endpoint=request.endpoint or 'unmatched', method=request.method, status=str(response.status_code)
+        )
+        return response
+
+    @app.teardown_request
+    def stop_request_profiler(exception):
+        # 例外で after_request が呼ばれなかった場合もプロファイラを必ず止める
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            seconds = time.perf_counter() - g.get('profile_started', time.perf_counter())
+            request_profiler.stop(profiler, request.endpoint, seconds)
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        # METRICS_ENDPOINT_TOKEN を設定した場合は Bearer トークンを要求する
+        token = os.environ.get('METRICS_ENDPOINT_TOKEN')
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    @app.route('/webhooks/github', methods=['POST'])
+    def github_webhook():
+        """GitHubの deployment_status / pull_request / issues（incident ラベル）イベントを受け取る"""
+        if not webhook_service.verify_signature(
+            webhook_service.GITHUB_WEBHOOK_SECRET, request.get_data(), request.headers.get('X-Hub-Signature-256')
+        ):
+            logger.warning(f"Rejected GitHub webhook delivery {request.headers.get('X-GitHub-Delivery')}: invalid signature")
+            return jsonify({'error': 'Invalid signature'}), 401
+
+        event_name = request.headers.get('X-GitHub-Event', '')
+        try:
+            repo = webhook_service.handle_github_event(event_name, request.get_json())
+        except Exception as e:
+            logger.error(f"Error handling GitHub {event_name} webhook: {str(e)}")
+            return jsonify({'error': 'Failed to apply event'}), 500
+
+        if repo:
+            refresh_scope_metrics('github', repo)
+        return jsonify({'status': 'applied' if repo else 'ignored'})
+
+    @app.route('/webhooks/jira', methods=['POST'])
+    def jira_webhook():
+        """JiraのIssueの作成・更新・削除イベントを受け取る"""
+        if not webhook_service.verify_signature(
+            webhook_service.JIRA_WEBHOOK_SECRET, request.get_data(), request.headers.get('X-Hub-Signature')
+        ):
+            logger.warning("Rejected Jira webhook delivery: invalid signature")
+            return jsonify({'error': 'Invalid signature'}), 401
+
+        try:
+            project = webhook_service.handle_jira_event(request.get_json())
+        except Exception as e:
+            logger.error(f"Error handling Jira webhook: {str(e)}")
+            return jsonify({'error': 'Failed to apply event'}), 500
+
+        if project:
+            refresh_scope_metrics('jira', project)
+        return jsonify({'status': 'applied' if project else 'ignored'})
+
     @app.route('/')
     def index():
         if current_user.is_authenticated:
@@ -77,14 +239,6 @@ def register_routes(app):
     @app.route('/dashboard')
     @login_required
     def dashboard():
-        # Initialize services with user tokens
-        github_service = GitHubService(current_user.github_token)
-        jira_service = JiraService(current_user.jira_token)
-
-        # Get metrics
-        github_metrics = github_service.get_four_keys_metrics()
-        jira_metrics = jira_service.get_metrics()
-
         # Get user preferences
         preferences = current_user.dashboard_preferences
         if not preferences:
@@ -92,6 +246,10 @@ def register_routes(app):
             db.session.add(preferences)
             db.session.commit()
 
+        # Get metrics（未計算のソースは2つ並行してバックグラウンドで計算し、ストリームで反映する）
+        github_metrics = get_dashboard_metrics(current_user, 'github')
+        jira_metrics = get_dashboard_metrics(current_user, 'jira')
+
         return render_template('dashboard.html',
                              github_metrics=github_metrics,
                              jira_metrics=jira_metrics,
@@ -100,14 +258,93 @@ def register_routes(app):
     @app.route('/api/metrics/refresh')
     @login_required
     def refresh_metrics():
-        github_service = GitHubService(current_user.github_token)
-        jira_service = JiraService(current_user.jira_token)
-
         return jsonify({
-            'github_metrics': github_service.get_four_keys_metrics(),
-            'jira_metrics': jira_service.get_metrics()
+            'github_metrics': get_cached_metrics(current_user, 'github'),
+            'jira_metrics': get_cached_metrics(current_user, 'jira')
         })
 
+    @app.route('/api/metrics/stream')
+    @login_required
+    def metrics_stream():
+        """
+        メトリクスの更新を Server-Sent Events で配信します
+        更新間隔ごとにキャッシュを参照し、期限切れなら再計算を1回だけ起こす（同じユーザーのタブ間で共有）
+        再計算の結果は、そのユーザーのすべてのストリームへ配信される
+        """
+        user_id = current_user.id
+        ttl = metrics_ttl(current_user)
+        subscription = metrics_broadcaster.subscribe(user_id)
+        # 長時間のストリームでデータベースの接続を保持し続けない
+        db.session.remove()
+
+        def stream():
+            try:
+                yield "retry: 5000\n\n"
+                # 接続前に計算済みの値があれば最初に送る
+                for source in METRIC_SOURCES:
+                    metrics = metrics_cache.peek((user_id, source, METRICS_WINDOW_DAYS))
+                    if metrics is not None:
+                        yield _format_event({'source': source, 'metrics': metrics})
+
+                next_refresh = time.monotonic() + ttl
+                while True:
+                    timeout = max(0, min(STREAM_HEARTBEAT_SECONDS, next_refresh - time.monotonic()))
+                    try:
+                        yield _format_event(subscription.get(timeout=timeout))
+                    except queue.Empty:
+                        yield ": keepalive\n\n"
+
+                    if time.monotonic() >= next_refresh:
+                        next_refresh = time.monotonic() + ttl
+                        # 期限切れならバックグラウンドで再計算され、終わり次第 _publish_metrics で配信される
+                        # （計算を待たないため、遅い同期や計算の失敗でストリームが止まらない）
+                        with app.app_context():
+                            for source in METRIC_SOURCES:
+                                metrics_cache.get_nowait(
+                                    (user_id, source, METRICS_WINDOW_DAYS), ttl,
+                                    _metrics_computation(user_id, source, METRICS_WINDOW_DAYS)
+                                )
+            finally:
+                metrics_broadcaster.unsubscribe(user_id, subscription)
+
+        return Response(
+            stream(),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    @app.route('/api/metrics/history')
+    @login_required
+    def metrics_history():
+        source = request.args.get('source', 'github')
+        metric_type = request.args.get('metric')
+        if source not in ('github', 'jira') or not metric_type:
+            return jsonify({'status': 'error', 'message': 'source and metric are required'}), 400
+
+        days = min(max(request.args.get('days', 30, type=int), 1), 366)
+        points = min(max(request.args.get('points', 30, type=int), 1), 500)
+        end_date = datetime.utcnow()
+        start_date = end_date - timedelta(days=days)
+
+        return jsonify(metric_history.get_history(
+            current_user.id, source, metric_type, start_date, end_date, points
+        ))
+
+    @app.route('/api/metrics/distribution')
+    @login_required
+    def metrics_distribution():
+        units = {'lead_time': 'days', 'time_to_restore': 'hours'}
+        metric_type = request.args.get('metric')
+        if metric_type not in units:
+            return jsonify({'status': 'error', 'message': 'metric must be lead_time or time_to_restore'}), 400
+
+        days = min(max(request.args.get('days', 30, type=int), 1), 366)
+        end_date = datetime.utcnow()
+        start_date = end_date - timedelta(days=days)
+
+        distribution = event_store.get_duration_distribution(current_user.id, metric_type, start_date, end_date)
+        return jsonify(dict(distribution, metric_type=metric_type, unit=units[metric_type]))
+
     @app.route('/api/preferences', methods=['POST'])
     @login_required
     def update_preferences():
@@ -156,9 +393,23 @@ def register_routes(app):
     @login_required
     def preview_markdown():
         try:
-            content = request.get_json().get('content', '')
-            html = markdown.markdown(content, extensions=['fenced_code', 'tables'])
-            return jsonify({'html': html})
+            data = request.get_json()
+            # document_id を付けると内容をサーバーに保持し、以降は changes（行単位の差分）だけ送れる
+            document_id = data.get('document_id')
+            key = (current_user.id, str(document_id))
+            if 'changes' in data:
+                if not document_id:
+                    return jsonify({'error': 'document_id is required with changes'}), 400
+                revision, lines = preview_documents.apply(key, data.get('revision'), data['changes'])
+            else:
+                content = data.get('content', '').replace('\r\n', '\n')
+                if document_id:
+                    revision, lines = preview_documents.replace(key, content)
+                else:
+                    revision, lines = None, content.split('\n')
+            return jsonify({'html': markdown_renderer.render(lines), 'revision': revision})
+        except PreviewOutOfSync as e:
+            return jsonify({'error': str(e), 'resync': True}), 409
         except Exception as e:
             logger.error(f"Error converting markdown: {str(e)}")
             return jsonify({'error': str(e)}), 500
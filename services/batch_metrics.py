@@ -0,0 +1,169 @@
+import os
+import json
+import logging
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError, OperationalError
+from app import db, create_app
+from models import User
+from services import metric_history
+from services.sync_service import sync_and_compute_metrics
+
+logger = logging.getLogger(__name__)
+
+# 同時に計算するプロセス数
+DEFAULT_BATCH_WORKERS = int(os.environ.get('METRICS_BATCH_WORKERS', os.cpu_count() or 2))
+
+# この件数の結果ごとにまとめて保存し、チェックポイントを更新する
+DEFAULT_BATCH_FLUSH_SIZE = int(os.environ.get('METRICS_BATCH_FLUSH_SIZE', 50))
+
+# 進捗を記録するファイル（中断したら同じファイルを指定して再開する）
+DEFAULT_CHECKPOINT_PATH = os.environ.get('METRICS_BATCH_CHECKPOINT', 'compute_metrics.checkpoint.json')
+
+# 別のプロセスが同じリポジトリを同時に保存して競合した場合の再試行回数（同期は冪等なのでやり直せる）
+WORKER_RETRIES = int(os.environ.get('METRICS_BATCH_RETRIES', 3))
+
+SOURCES = ('github', 'jira')
+
+_worker_app = None
+
+def _init_worker():
+    """ワーカープロセスごとにアプリケーションを1回だけ作る（接続はプロセス間で共有しない）"""
+    global _worker_app
+    logging.getLogger().setLevel(logging.WARNING)
+    _worker_app = create_app()
+
+def compute_user_metrics(user_id, sources, window_days):
+    """
+    ワーカープロセスで1ユーザー分を同期・計算し、保存する内容を返します
+    戻り値: [(ソース, メトリクス), ...]（トークンが設定されているソースのみ）
+    """
+    for attempt in range(WORKER_RETRIES + 1):
+        try:
+            return _compute_user_metrics(user_id, sources, window_days)
+        except (IntegrityError, OperationalError) as e:
+            if attempt == WORKER_RETRIES:
+                raise
+            logger.warning(f"Retrying user {user_id} after a conflicting write: {str(e)}")
+            time.sleep(0.5 * (attempt + 1))
+
+def _compute_user_metrics(user_id, sources, window_days):
+    with _worker_app.app_context():
+        user = db.session.get(User, user_id)
+        if user is None:
+            return []
+        tokens = {'github': user.github_token, 'jira': user.jira_token}
+        results = []
+        try:
+            for source in sources:
+                if tokens[source]:
+                    metrics = sync_and_compute_metrics(user_id, source, window_days, record=False)
+                    metrics.pop("freshness", None)
+                    metrics.pop("windows", None)
+                    results.append((source, metrics))
+        finally:
+            db.session.remove()
+        return results
+
+class Checkpoint:
+    """
+    計算済みのユーザーを記録するファイル
+    結果を保存してコミットした後に更新するため、中断しても保存済みの分だけが完了扱いになる
+    """
+
+    def __init__(self, path, params):
+        self.path = path
+        self.params = params
+        self.completed = set()
+
+    def load(self):
+        """
+        途中経過があれば読み込み、完了済みのユーザー数を返します
+        別の条件で書かれたものは上書きしないよう ValueError を送出する
+        """
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path) as f:
+            data = json.load(f)
+        if data.get("params") != self.params:
+            raise ValueError(f"Checkpoint {self.path} was written with different options")
+        self.completed = set(data.get("completed", []))
+        return len(self.completed)
+
+    def save(self):
+        # 書き込み途中で中断しても壊れないよう、一時ファイルに書いてから置き換える
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({
+                "params": self.params,
+                "completed": sorted(self.completed),
+                "updated_at": datetime.utcnow().isoformat()
+            }, f)
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def run_batch(user_ids, sources=SOURCES, window_days=30, workers=DEFAULT_BATCH_WORKERS,
+              checkpoint_path=DEFAULT_CHECKPOINT_PATH, flush_size=DEFAULT_BATCH_FLUSH_SIZE, restart=False,
+              selection="all"):
+    """
+    ユーザーごとのメトリクスをプロセスプールで計算し、Metric にまとめて保存します
+    アプリケーションコンテキスト内で呼び出すこと
+    selection: 対象ユーザーの指定（チェックポイントの条件に含め、別の指定の実行とは混ぜない）
+    戻り値: {"computed", "skipped", "failed"}
+    """
+    checkpoint = Checkpoint(
+        checkpoint_path, {"sources": sorted(sources), "window_days": window_days, "users": selection}
+    )
+    if restart:
+        checkpoint.remove()
+    skipped = checkpoint.load()
+    pending = [user_id for user_id in user_ids if user_id not in checkpoint.completed]
+    if skipped:
+        logger.info(f"Resuming from {checkpoint_path}: {skipped} users already computed")
+
+    computed = 0
+    failed = []
+    buffered = []  # [(ユーザーID, [(ソース, メトリクス), ...])]
+
+    def flush():
+        nonlocal computed
+        if not buffered:
+            return
+        metric_history.record_metrics_bulk([
+            (user_id, source, metrics, None) for user_id, results in buffered for source, metrics in results
+        ])
+        db.session.commit()
+        checkpoint.completed.update(user_id for user_id, _ in buffered)
+        checkpoint.save()
+        computed += len(buffered)
+        logger.info(f"Saved metrics for {computed}/{len(pending)} users")
+        buffered.clear()
+
+    # fork だと親プロセスのデータベース接続やスレッドを引き継ぐため spawn で起動する
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=context, initializer=_init_worker) as executor:
+        futures = {
+            executor.submit(compute_user_metrics, user_id, tuple(sources), window_days): user_id
+            for user_id in pending
+        }
+        for future in as_completed(futures):
+            user_id = futures[future]
+            try:
+                buffered.append((user_id, future.result()))
+            except Exception as e:
+                logger.error(f"Error computing metrics for user {user_id}: {str(e)}")
+                failed.append(user_id)
+                continue
+            if len(buffered) >= flush_size:
+                flush()
+        flush()
+
+    # 全員分が終わったらチェックポイントは不要（失敗したユーザーがいれば再実行で続きから計算する）
+    if not failed:
+        checkpoint.remove()
+    return {"computed": computed, "skipped": skipped, "failed": failed}
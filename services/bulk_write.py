@@ -0,0 +1,67 @@
+import os
+import logging
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# 1回の INSERT にまとめる最大行数
+BULK_WRITE_CHUNK_SIZE = int(os.environ.get('BULK_WRITE_CHUNK_SIZE', 500))
+
+# 1文あたりのバインド変数の上限（SQLite 3.32 以降 / PostgreSQL）
+MAX_BIND_PARAMETERS = {'sqlite': 32766, 'postgresql': 65535}
+
+_INSERT_FUNCTIONS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+def supports_upsert():
+    """INSERT ... ON CONFLICT が使えるか（使えない場合は呼び出し側で ORM による更新に切り替える）"""
+    return _dialect() in _INSERT_FUNCTIONS
+
+def least(a, b):
+    """2つの値の小さい方（片方が NULL ならもう片方）"""
+    if _dialect() == 'postgresql':
+        return func.least(a, b)
+    return func.min(func.coalesce(a, b), func.coalesce(b, a))
+
+def greatest(a, b):
+    """2つの値の大きい方（片方が NULL ならもう片方）"""
+    if _dialect() == 'postgresql':
+        return func.greatest(a, b)
+    return func.max(func.coalesce(a, b), func.coalesce(b, a))
+
+def _insert_statements(model, rows):
+    """バインド変数の上限に収まるようチャンクに分けた INSERT 文"""
+    dialect = _dialect()
+    insert = _INSERT_FUNCTIONS[dialect]
+    chunk_size = max(1, min(BULK_WRITE_CHUNK_SIZE, MAX_BIND_PARAMETERS[dialect] // len(rows[0])))
+    for start in range(0, len(rows), chunk_size):
+        yield insert(model).values(rows[start:start + chunk_size])
+
+def upsert(model, rows, conflict_columns, update):
+    """
+    行をまとめて INSERT し、conflict_columns が一致する既存の行は更新します
+    ORM のオブジェクトを作らず、チャンクごとに1文で書き込む（別のプロセスが同時に追加した行とも競合しない）
+    update: 列名のリスト（新しい値で上書き）、または excluded を受け取り {列名: 式} を返す関数
+    rows: 列名をキーとする辞書のリスト（すべて同じキーを持つこと）
+    """
+    if not rows:
+        return 0
+    for statement in _insert_statements(model, rows):
+        if callable(update):
+            values = update(statement.excluded)
+        else:
+            values = {column: statement.excluded[column] for column in update}
+        db.session.execute(statement.on_conflict_do_update(index_elements=conflict_columns, set_=values))
+    logger.debug(f"Upserted {len(rows)} {model.__tablename__} rows")
+    return len(rows)
+
+def insert_missing(model, rows, conflict_columns):
+    """conflict_columns が一致する行が無いものだけ追加する（既存の行、同時に追加された行はそのまま）"""
+    if not rows:
+        return
+    for statement in _insert_statements(model, rows):
+        db.session.execute(statement.on_conflict_do_nothing(index_elements=conflict_columns))
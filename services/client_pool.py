@@ -0,0 +1,79 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class ClientPool:
+    """
+    トークンごとに認証済みのAPIクライアントを再利用するプロセス全体のプール
+    - クライアントとそのHTTPセッションをリクエスト間で使い回す
+    - トークンの検証は初回利用時と validate_interval 秒ごとにのみ行う
+    - idle_timeout 秒使われなかったクライアントは破棄する
+    """
+
+    def __init__(self, name, factory, validate=None, close=None, idle_timeout=1800, validate_interval=3600):
+        self.name = name
+        self.factory = factory
+        self.validate = validate
+        self.close = close
+        self.idle_timeout = idle_timeout
+        self.validate_interval = validate_interval
+        self._clients = {}  # key -> {"client", "last_used", "validated_at"}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        キーに対応するクライアントを返します
+        検証に失敗した場合はプールから外して None を返します
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is None:
+                entry = {"client": self.factory(key), "last_used": now, "validated_at": None}
+                self._clients[key] = entry
+                logger.debug(f"Created {self.name} client ({len(self._clients)} pooled)")
+            entry["last_used"] = now
+
+            needs_validation = self.validate is not None and (
+                entry["validated_at"] is None or now - entry["validated_at"] >= self.validate_interval
+            )
+            if needs_validation:
+                # 同時に来たリクエストが重ねて検証しないよう先に記録しておく
+                entry["validated_at"] = now
+
+        if needs_validation:
+            try:
+                valid = self.validate(entry["client"])
+            except Exception:
+                self.discard(key)
+                raise
+            if not valid:
+                self.discard(key)
+                return None
+        return entry["client"]
+
+    def discard(self, key):
+        """クライアントをプールから外して閉じる"""
+        with self._lock:
+            entry = self._clients.pop(key, None)
+        if entry is not None:
+            self._close(entry["client"])
+
+    def _evict_idle(self, now):
+        idle_keys = [key for key, entry in self._clients.items() if now - entry["last_used"] >= self.idle_timeout]
+        for key in idle_keys:
+            entry = self._clients.pop(key)
+            self._close(entry["client"])
+        if idle_keys:
+            logger.debug(f"Evicted {len(idle_keys)} idle {self.name} clients")
+
+    def _close(self, client):
+        if self.close is None:
+            return
+        try:
+            self.close(client)
+        except Exception as e:
+            logger.warning(f"Error closing {self.name} client: {str(e)}")
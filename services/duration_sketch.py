@@ -0,0 +1,110 @@
+import json
+import math
+
+# これ以下の値は0のバケットに入れる
+MIN_TRACKED_VALUE = 1e-9
+
+class DurationSketch:
+    """
+    対数幅のバケットに件数だけを数える分位点スケッチ
+    - 分位点の相対誤差は relative_accuracy 以内
+    - バケットの件数を足し合わせるだけでリポジトリ間・ワーカー間でマージできる
+    - バケット番号と件数だけを保存するので、期間を変えた再集計にもそのまま使える
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """値を1件追加（負の値は0として扱う）"""
+        value = max(0.0, value)
+        if value <= MIN_TRACKED_VALUE:
+            self.zero_count += 1
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """別のスケッチの件数を取り込む"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def quantile(self, q):
+        """q（0〜1）分位点の近似値"""
+        if not self.count:
+            return 0
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # バケットの代表値（相対誤差が最小になる点）を最小値・最大値の範囲に収める
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self, digits=2):
+        """平均と p50 / p90 / p99"""
+        return {
+            "value": round(self.mean(), digits),
+            "p50": round(self.quantile(0.5), digits),
+            "p90": round(self.quantile(0.9), digits),
+            "p99": round(self.quantile(0.99), digits)
+        }
+
+    def to_dict(self):
+        """保存用のコンパクトな辞書（他のJSONに埋め込む場合に使う）"""
+        return {
+            "a": self.relative_accuracy,
+            "z": self.zero_count,
+            "n": self.count,
+            "s": self.total,
+            "lo": self.min,
+            "hi": self.max,
+            "b": sorted(self.buckets.items())
+        }
+
+    def to_json(self):
+        """保存用のコンパクトなJSON文字列"""
+        return json.dumps(self.to_dict(), separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, data):
+        return cls.from_dict(json.loads(data))
+
+    @classmethod
+    def from_dict(cls, values):
+        sketch = cls(values["a"])
+        sketch.zero_count = values["z"]
+        sketch.count = values["n"]
+        sketch.total = values["s"]
+        sketch.min = values["lo"]
+        sketch.max = values["hi"]
+        sketch.buckets = {index: count for index, count in values["b"]}
+        return sketch
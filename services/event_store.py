@@ -0,0 +1,545 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import SourceEvent, EventSketch, ScopeDailyStats, SyncWatermark, ScopeAccess
+from services import bulk_write
+from services.duration_sketch import DurationSketch
+from services.github_service import GitHubService, FourKeysStats, EVENT_KINDS, lead_time_days, restore_time_hours
+from services.jira_service import JiraService
+from services.sliding_window import DailyBuckets, window_start_day, boundary_range
+
+logger = logging.getLogger(__name__)
+
+# IN句1回あたりのID数
+QUERY_CHUNK_SIZE = 500
+
+# まとめて計算する集計期間（日数）。リポジトリごとの日ごとの集計は最長の期間分だけ保持する
+METRIC_WINDOWS = tuple(sorted({int(days) for days in os.environ.get('METRIC_WINDOWS', '7,30,90').split(',')}))
+
+# 日ごとのスケッチを保存するイベント種別と、そのメトリクス名・所要時間の計算方法
+SKETCH_METRICS = {
+    "pull_requests": ("lead_time", lead_time_days),
+    "incidents": ("time_to_restore", restore_time_hours)
+}
+
+def _chunks(items, size=QUERY_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _github_row_values(kind, event):
+    """GitHubService のイベント辞書を SourceEvent の列に変換"""
+    if kind == "deployments":
+        return {"external_id": str(event["id"]), "created_at": event["created_at"], "failed": event["failed"]}
+    if kind == "pull_requests":
+        return {"external_id": str(event["number"]), "created_at": event["created_at"], "resolved_at": event["merged_at"]}
+    return {"external_id": str(event["number"]), "created_at": event["created_at"], "resolved_at": event["closed_at"]}
+
+def _github_event(kind, scope, external_id, created_at, resolved_at, failed):
+    """SourceEvent の列を GitHubService のイベント辞書に戻す"""
+    if kind == "deployments":
+        return {"repo": scope, "id": int(external_id), "created_at": created_at, "failed": failed}
+    if kind == "pull_requests":
+        return {"repo": scope, "number": int(external_id), "created_at": created_at, "merged_at": resolved_at}
+    return {"repo": scope, "number": int(external_id), "created_at": created_at, "closed_at": resolved_at}
+
+def upsert_events(source, scope, event_type, rows):
+    """
+    同じスコープ・種別のイベントを external_id で照合し、既存は更新・新規は追加します
+    rows: SourceEvent の列名をキーとする辞書のリスト
+    """
+    rows_by_id = {row["external_id"]: row for row in rows}
+    ids = list(rows_by_id)
+    if bulk_write.supports_upsert():
+        # 1件ずつ ORM で読み込み・追加せず、INSERT ... ON CONFLICT でまとめて書き込む
+        values = [
+            dict(row, source=source, scope=scope, event_type=event_type) for row in rows_by_id.values()
+        ]
+        if values:
+            bulk_write.upsert(
+                SourceEvent, values, ['source', 'scope', 'event_type', 'external_id'],
+                [column for column in values[0] if column not in ('source', 'scope', 'event_type', 'external_id')]
+            )
+        return len(ids)
+
+    for chunk in _chunks(ids):
+        existing = SourceEvent.query.filter(
+            SourceEvent.source == source,
+            SourceEvent.scope == scope,
+            SourceEvent.event_type == event_type,
+            SourceEvent.external_id.in_(chunk)
+        )
+        for event in existing:
+            for column, value in rows_by_id.pop(event.external_id).items():
+                setattr(event, column, value)
+
+    for row in rows_by_id.values():
+        db.session.add(SourceEvent(source=source, scope=scope, event_type=event_type, **row))
+    return len(ids)
+
+def save_github_events(repo, kind, events):
+    """GitHubのイベントを保存し、影響する日のスケッチを作り直す"""
+    rows = [_github_row_values(kind, event) for event in events]
+    saved = upsert_events('github', repo, kind, rows)
+    if rows:
+        # イベントが変わった日の中間集計だけを作り直す
+        db.session.flush()
+        _rebuild_day_buckets(repo, {_day(_metric_timestamp(kind, event)) for event in events})
+    if kind in SKETCH_METRICS and rows:
+        _rebuild_daily_sketches(repo, kind, {_day(row["resolved_at"]) for row in rows})
+    return saved
+
+def _metric_timestamp(kind, event):
+    """集計期間の判定に使う日時（デプロイメントは作成日時、それ以外は解決日時）"""
+    return event["created_at"] if kind == "deployments" else event.get("merged_at", event.get("closed_at"))
+
+def apply_github_event(repo, kind, external_id, event):
+    """
+    Webhookで受け取ったイベント1件を保存し、リポジトリの中間集計と日ごとのスケッチに反映します
+    event が None の場合は集計対象から外す（incident ラベルが外された・再オープンされた Issue など）
+    - 新しく集計対象になったイベントは、その日の中間集計に加算するだけ（件数に依存しない）
+    - デプロイメントの失敗の有無が変わった場合は件数を差し替える
+    - 集計済みのリードタイム・復旧時間が変わった場合だけ、該当日の中間集計とスケッチを作り直す
+    変更があった場合は True を返す
+    """
+    external_id = str(external_id)
+    row = SourceEvent.query.filter_by(
+        source='github', scope=repo, event_type=kind, external_id=external_id
+    ).first()
+    previous = None
+    if row is not None:
+        previous = _github_event(kind, repo, row.external_id, row.created_at, row.resolved_at, row.failed)
+        if kind != "deployments" and row.resolved_at is None:
+            previous = None
+
+    if event is None:
+        if row is None:
+            return False
+        db.session.delete(row)
+    else:
+        values = _github_row_values(kind, event)
+        if row is None:
+            db.session.add(SourceEvent(source='github', scope=repo, event_type=kind, **values))
+        else:
+            for column, value in values.items():
+                setattr(row, column, value)
+
+    if previous is not None and previous == event:
+        return False
+
+    # イベントを先に書き込む。SQLite ではこの時点でデータベースの書き込みロックを取るため、
+    # 以降の中間集計の読み込みから書き込みまでが同じリポジトリへの他の更新と重ならない
+    db.session.flush()
+    if previous is None:
+        if event is not None:
+            _add_to_aggregates(repo, kind, event)
+    elif kind == "deployments" and event is not None:
+        _adjust_failed_deployments(repo, previous, event)
+    else:
+        days = {_day(_metric_timestamp(kind, previous))}
+        if event is not None:
+            days.add(_day(_metric_timestamp(kind, event)))
+        _rebuild_day_buckets(repo, days)
+        if kind in SKETCH_METRICS:
+            _rebuild_daily_sketches(repo, kind, days)
+    return True
+
+def _locked_scope_stats(scope):
+    """
+    リポジトリの中間集計の行を読み込み、トランザクションの終わりまでロックする
+    （同じリポジトリへのWebhookや同期が同時に読み書きして加算が失われないように）
+    """
+    return ScopeDailyStats.query.filter_by(source='github', scope=scope).with_for_update().populate_existing().first()
+
+def _locked_sketches(scope, metric_type, days):
+    """
+    日ごとのスケッチの行を（無ければ空で作って）ロックし、{日: 行} を返します
+    デッドロックしないよう日の順にロックする
+    """
+    days = sorted(days)
+    if bulk_write.supports_upsert():
+        bulk_write.insert_missing(EventSketch, [
+            {"source": 'github', "scope": scope, "metric_type": metric_type, "day": day,
+             "data": DurationSketch().to_json()}
+            for day in days
+        ], ['source', 'scope', 'metric_type', 'day'])
+    rows = {
+        row.day: row for row in EventSketch.query.filter(
+            EventSketch.source == 'github',
+            EventSketch.scope == scope,
+            EventSketch.metric_type == metric_type,
+            EventSketch.day.in_(days)
+        ).order_by(EventSketch.day).with_for_update().populate_existing()
+    }
+    for day in days:
+        if day not in rows:
+            rows[day] = EventSketch(source='github', scope=scope, metric_type=metric_type, day=day)
+            db.session.add(rows[day])
+    return rows
+
+def _add_to_aggregates(repo, kind, event):
+    """保存済みの日ごとの中間集計とスケッチに1件加算"""
+    timestamp = _metric_timestamp(kind, event)
+    row = _locked_scope_stats(repo)
+    if row is not None and timestamp >= row.from_day:
+        buckets = DailyBuckets.from_json(row.data, FourKeysStats)
+        buckets.bucket(timestamp).add(kind, event)
+        _store_buckets(row, buckets)
+
+    if kind in SKETCH_METRICS:
+        metric_type, duration = SKETCH_METRICS[kind]
+        day = _day(timestamp)
+        row = _locked_sketches(repo, metric_type, [day])[day]
+        sketch = DurationSketch.from_json(row.data) if row.data else DurationSketch()
+        sketch.add(duration(event))
+        row.data = sketch.to_json()
+
+def _adjust_failed_deployments(repo, previous, event):
+    """集計済みのデプロイメントの失敗の有無が変わった分だけ件数を差し替える"""
+    delta = int(bool(event["failed"])) - int(bool(previous["failed"]))
+    if delta == 0:
+        return
+    row = _locked_scope_stats(repo)
+    if row is not None and previous["created_at"] >= row.from_day:
+        buckets = DailyBuckets.from_json(row.data, FourKeysStats)
+        buckets.bucket(previous["created_at"]).failed_deployments += delta
+        _store_buckets(row, buckets)
+
+def get_github_event(repo, kind, external_id):
+    """保存済みのイベント1件を GitHubService のイベント辞書で返す（無ければ None）"""
+    row = SourceEvent.query.filter_by(
+        source='github', scope=repo, event_type=kind, external_id=str(external_id)
+    ).first()
+    if row is None:
+        return None
+    return _github_event(kind, repo, row.external_id, row.created_at, row.resolved_at, row.failed)
+
+def _day(timestamp):
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _rebuild_daily_sketches(scope, kind, days):
+    """
+    保存済みのイベントから日ごとのスケッチを作り直します
+    同期の重なりで同じイベントを再取得しても二重に数えないよう、追加ではなく再構築する
+    """
+    metric_type, duration = SKETCH_METRICS[kind]
+    # イベントを読む前に行をロックし、同時に保存されたイベントの分を上書きで失わないようにする
+    existing = _locked_sketches(scope, metric_type, days)
+    sketches = {day: DurationSketch() for day in days}
+    rows = db.session.query(
+        SourceEvent.external_id, SourceEvent.created_at, SourceEvent.resolved_at
+    ).filter(
+        SourceEvent.source == 'github',
+        SourceEvent.scope == scope,
+        SourceEvent.event_type == kind,
+        SourceEvent.resolved_at >= min(days),
+        SourceEvent.resolved_at < max(days) + timedelta(days=1)
+    )
+    for external_id, created_at, resolved_at in rows:
+        sketch = sketches.get(_day(resolved_at))
+        if sketch is not None:
+            sketch.add(duration(_github_event(kind, scope, external_id, created_at, resolved_at, False)))
+
+    for day, sketch in sketches.items():
+        existing[day].data = sketch.to_json()
+
+def get_duration_distribution(user_id, metric_type, start_date, end_date):
+    """ユーザーが参照できるリポジトリの日ごとのスケッチをマージして分布を返す（上流への再取得は不要）"""
+    sketch = DurationSketch()
+    rows = db.session.query(EventSketch.data).join(
+        ScopeAccess,
+        and_(ScopeAccess.source == EventSketch.source, ScopeAccess.scope == EventSketch.scope)
+    ).filter(
+        ScopeAccess.user_id == user_id,
+        EventSketch.metric_type == metric_type,
+        EventSketch.day.between(_day(start_date), end_date)
+    )
+    for (data,) in rows:
+        sketch.merge(DurationSketch.from_json(data))
+    return dict(sketch.summary(), count=sketch.count)
+
+def save_jira_issues(issues):
+    """JiraのIssueをプロジェクトごとに保存"""
+    rows_by_project = {}
+    for issue in issues:
+        rows_by_project.setdefault(issue["project"], []).append({
+            "external_id": issue["key"],
+            "created_at": issue["created_at"],
+            "updated_at": issue["updated_at"],
+            "resolved_at": issue["resolved_at"],
+            "status": issue["status_category"]
+        })
+    for project, rows in rows_by_project.items():
+        upsert_events('jira', project, 'issues', rows)
+    return list(rows_by_project)
+
+def apply_jira_issue(issue, deleted=False):
+    """Webhookで受け取ったIssue1件を保存（削除されたIssueはストアから除く）"""
+    if deleted:
+        SourceEvent.query.filter_by(
+            source='jira', scope=issue["project"], event_type='issues', external_id=issue["key"]
+        ).delete()
+        return issue["project"]
+    return save_jira_issues([issue])[0]
+
+def get_scope_users(source, scope):
+    """スコープを参照できるユーザーのID"""
+    return [user_id for (user_id,) in db.session.query(ScopeAccess.user_id).filter_by(source=source, scope=scope)]
+
+def get_watermarks(source, scopes):
+    """{(スコープ, リソース): SyncWatermark} を返す"""
+    watermarks = {}
+    for chunk in _chunks(list(scopes)):
+        for watermark in SyncWatermark.query.filter(SyncWatermark.source == source, SyncWatermark.scope.in_(chunk)):
+            watermarks[(watermark.scope, watermark.resource)] = watermark
+    return watermarks
+
+def set_watermark(source, scope, resource, high_water_mark, etag=None, watermark=None):
+    """同期済み位置を記録"""
+    if watermark is None:
+        watermark = SyncWatermark.query.filter_by(source=source, scope=scope, resource=resource).first()
+    if watermark is None:
+        watermark = SyncWatermark(source=source, scope=scope, resource=resource)
+        db.session.add(watermark)
+    watermark.high_water_mark = high_water_mark
+    watermark.etag = etag
+    watermark.synced_at = datetime.utcnow()
+    return watermark
+
+def rewind_watermarks(source, scopes, resource, high_water_mark):
+    """同期済み位置を high_water_mark まで戻す（次の同期でそれ以降を取得し直す）"""
+    for (scope, watermark_resource), watermark in get_watermarks(source, scopes).items():
+        if watermark_resource == resource and watermark.high_water_mark > high_water_mark:
+            watermark.high_water_mark = high_water_mark
+
+def get_freshness(user_id, source, synced_since):
+    """
+    ユーザーが参照できるスコープの同期状況を返します
+    - status: fresh（すべて synced_since 以降に同期済み）/ partial（一部が未同期）/ stale（今回1件も同期できていない）
+    - as_of: 最も古い同期済み位置（ISO 8601）
+    - pending: synced_since 以降に同期できていないスコープ・イベント種別の数
+    """
+    if source == 'github':
+        scopes = _accessible_scopes(user_id, source)
+        resources = EVENT_KINDS
+    else:
+        scopes = [f"user:{user_id}"]
+        resources = ("issues",)
+
+    watermarks = get_watermarks(source, scopes)
+    marks = [watermarks.get((scope, resource)) for scope in scopes for resource in resources]
+    synced = [mark.high_water_mark for mark in marks if mark is not None]
+    pending = sum(1 for mark in marks if mark is None or mark.high_water_mark < synced_since)
+
+    if pending == 0:
+        status = "fresh"
+    elif pending < len(marks):
+        status = "partial"
+    else:
+        status = "stale"
+    return {
+        "status": status,
+        "as_of": min(synced).isoformat() if synced else None,
+        "pending": pending
+    }
+
+def set_scope_access(user_id, source, scopes, replace=False):
+    """
+    ユーザーが参照できるスコープを記録します
+    replace=True の場合は一覧に含まれないスコープへのアクセスを取り消す
+    """
+    scopes = set(scopes)
+    now = datetime.utcnow()
+    for access in ScopeAccess.query.filter_by(user_id=user_id, source=source):
+        if access.scope in scopes:
+            access.checked_at = now
+            scopes.discard(access.scope)
+        elif replace:
+            db.session.delete(access)
+    for scope in scopes:
+        db.session.add(ScopeAccess(user_id=user_id, source=source, scope=scope, checked_at=now))
+
+def _accessible_events(user_id, source):
+    return db.session.query(SourceEvent).join(
+        ScopeAccess,
+        and_(ScopeAccess.source == SourceEvent.source, ScopeAccess.scope == SourceEvent.scope)
+    ).filter(ScopeAccess.user_id == user_id, SourceEvent.source == source)
+
+def _accessible_scopes(user_id, source):
+    return [scope for (scope,) in db.session.query(ScopeAccess.scope).filter_by(user_id=user_id, source=source)]
+
+def get_repo_buckets(scopes, from_day):
+    """
+    リポジトリごとの日ごとの中間集計（DailyBuckets）を返します
+    保存済みで from_day 以降をすべて含むものは再利用し、無いものだけイベントから計算して保存する
+    各日の集計は時間が経っても変わらないため、集計期間が進んでも作り直す必要はない
+    同じリポジトリを参照するユーザー間で共有されるため、計算量はユーザー数ではなくリポジトリ数に比例する
+    """
+    buckets = {}
+    for chunk in _chunks(list(scopes)):
+        rows = ScopeDailyStats.query.filter(
+            ScopeDailyStats.source == 'github',
+            ScopeDailyStats.scope.in_(chunk),
+            ScopeDailyStats.from_day <= from_day
+        )
+        for row in rows:
+            buckets[row.scope] = DailyBuckets.from_json(row.data, FourKeysStats)
+
+    missing = [scope for scope in scopes if scope not in buckets]
+    if missing:
+        computed = _compute_day_buckets(missing, from_day)
+        _save_day_buckets(computed, from_day)
+        buckets.update(computed)
+    return buckets
+
+def _iter_github_events(scopes, start_date, end_date):
+    """集計期間の判定に使う日時が [start_date, end_date) のイベントを (種別, イベント) で返す"""
+    columns = (
+        SourceEvent.event_type, SourceEvent.scope, SourceEvent.external_id,
+        SourceEvent.created_at, SourceEvent.resolved_at, SourceEvent.failed
+    )
+    for chunk in _chunks(list(scopes)):
+        query = db.session.query(*columns).filter(
+            SourceEvent.source == 'github',
+            SourceEvent.scope.in_(chunk),
+            or_(
+                and_(SourceEvent.event_type == 'deployments', SourceEvent.created_at >= start_date,
+                     SourceEvent.created_at < end_date),
+                and_(SourceEvent.event_type != 'deployments', SourceEvent.resolved_at >= start_date,
+                     SourceEvent.resolved_at < end_date)
+            )
+        )
+        for kind, scope, external_id, created_at, resolved_at, failed in query.yield_per(QUERY_CHUNK_SIZE):
+            yield kind, _github_event(kind, scope, external_id, created_at, resolved_at, failed)
+
+def _compute_day_buckets(scopes, from_day, days=None):
+    """from_day 以降のイベントをリポジトリ・日ごとに集計（days を指定した場合はその日だけ）"""
+    buckets = {scope: DailyBuckets(FourKeysStats) for scope in scopes}
+    end_date = max(days) + timedelta(days=1) if days else datetime.utcnow() + timedelta(days=1)
+    for kind, event in _iter_github_events(scopes, from_day, end_date):
+        timestamp = _metric_timestamp(kind, event)
+        if days is None or _day(timestamp) in days:
+            buckets[event["repo"]].bucket(timestamp).add(kind, event)
+    return buckets
+
+def _compute_stats_between(scopes, start_date, end_date):
+    """[start_date, end_date) のイベントを1つの FourKeysStats に集計（集計期間の最初の日の途中からの分）"""
+    stats = FourKeysStats()
+    for kind, event in _iter_github_events(scopes, start_date, end_date):
+        stats.add(kind, event)
+    return stats
+
+def _rebuild_day_buckets(scope, days):
+    """保存済みの日ごとの中間集計のうち、指定した日の分だけをイベントから作り直す"""
+    row = _locked_scope_stats(scope)
+    days = {day for day in days if row is not None and day >= row.from_day}
+    if not days:
+        return
+    buckets = DailyBuckets.from_json(row.data, FourKeysStats)
+    rebuilt = _compute_day_buckets([scope], min(days), days)[scope]
+    for day in days:
+        buckets.buckets.pop(day, None)
+    buckets.merge(rebuilt)
+    _store_buckets(row, buckets)
+
+def _store_buckets(row, buckets):
+    """保持期間（最長の集計期間）より古い日を捨てて保存"""
+    first_day = window_start_day(datetime.utcnow(), max(METRIC_WINDOWS))
+    if row.from_day < first_day:
+        buckets.prune(first_day)
+        row.from_day = first_day
+    row.data = buckets.to_json()
+    row.updated_at = datetime.utcnow()
+
+def _save_day_buckets(buckets, from_day):
+    """日ごとの中間集計を保存（別のユーザーの計算と競合した場合は相手の結果を残す）"""
+    existing = {}
+    for chunk in _chunks(list(buckets)):
+        for row in ScopeDailyStats.query.filter(
+            ScopeDailyStats.source == 'github',
+            ScopeDailyStats.scope.in_(chunk)
+        ):
+            existing[row.scope] = row
+
+    try:
+        with db.session.begin_nested():
+            for scope, repo_buckets in buckets.items():
+                row = existing.get(scope)
+                if row is None:
+                    row = ScopeDailyStats(source='github', scope=scope)
+                    db.session.add(row)
+                row.from_day = from_day
+                row.data = repo_buckets.to_json()
+                row.updated_at = datetime.utcnow()
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        logger.debug("Repository aggregates were saved concurrently, keeping the other result")
+
+def iter_jira_issues(user_id, start_date):
+    """期間内に作成・解決されたIssueと未解決のIssueを JiraService と同じ形で1件ずつ返す"""
+    columns = (
+        SourceEvent.scope, SourceEvent.external_id, SourceEvent.created_at,
+        SourceEvent.updated_at, SourceEvent.resolved_at, SourceEvent.status
+    )
+    query = _accessible_events(user_id, 'jira').with_entities(*columns).filter(
+        SourceEvent.event_type == 'issues',
+        or_(
+            SourceEvent.created_at >= start_date,
+            SourceEvent.resolved_at >= start_date,
+            SourceEvent.resolved_at.is_(None)
+        )
+    )
+    for project, key, created_at, updated_at, resolved_at, status in query.yield_per(QUERY_CHUNK_SIZE):
+        yield {
+            "key": key,
+            "project": project,
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "resolved_at": resolved_at,
+            "status_category": status
+        }
+
+def compute_github_metrics_by_window(user_id, windows=METRIC_WINDOWS):
+    """
+    複数の集計期間のFour Keysメトリクスを1回の集計で計算します（{日数: メトリクス}）
+    リポジトリごとの日ごとの集計を日単位でマージしてから、新しい日から順に1回だけ合計する
+    """
+    end_date = datetime.utcnow()
+    from_day = window_start_day(end_date, max(windows))
+    scopes = _accessible_scopes(user_id, 'github')
+    merged = DailyBuckets(FourKeysStats)
+    for buckets in get_repo_buckets(scopes, from_day).values():
+        merged.merge(buckets)
+
+    def boundary(window_days):
+        # 期間の最初の日は途中からなので、その日の集計ではなく保存済みのイベントから数える
+        return _compute_stats_between(scopes, *boundary_range(end_date, window_days))
+
+    return {
+        window_days: GitHubService.calculate_metrics_from_stats(stats, end_date - timedelta(days=window_days), end_date)
+        for window_days, stats in merged.windows(windows, end_date, boundary).items()
+    }
+
+def compute_jira_metrics_by_window(user_id, windows=METRIC_WINDOWS):
+    """複数の集計期間のJiraメトリクスを、保存済みのIssueを1回走査して計算します（{日数: メトリクス}）"""
+    end_date = datetime.utcnow()
+    start_date = window_start_day(end_date, max(windows))
+    return JiraService.calculate_metrics_by_window(iter_jira_issues(user_id, start_date), windows, end_date)
+
+def compute_metrics(user_id, source, window_days=30):
+    """
+    window_days のメトリクスに、METRIC_WINDOWS の各期間の値（"windows"）を添えて返します
+    すべての期間を1回の集計で計算する
+    """
+    windows = sorted(set(METRIC_WINDOWS) | {window_days})
+    if source == 'github':
+        by_window = compute_github_metrics_by_window(user_id, windows)
+    else:
+        by_window = compute_jira_metrics_by_window(user_id, windows)
+    comparison = {str(days): dict(by_window[days]) for days in METRIC_WINDOWS}
+    metrics = by_window[window_days]
+    metrics["windows"] = comparison
+    return metrics
@@ -0,0 +1,41 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class GitHubQueryPlan:
+    """
+    集計期間を上流APIのクエリ条件に変換するクエリプラン
+    - Issueは since で期間より前に更新されたものを除外
+    - プルリクエストとデプロイメントは新しい順に取得し、期間を過ぎたページで打ち切る
+    """
+
+    def __init__(self, start_date, end_date):
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def pulls_query(self):
+        """get_pulls() に渡す条件（更新日時の降順）"""
+        return {"state": "closed", "sort": "updated", "direction": "desc"}
+
+    def incidents_query(self):
+        """get_issues() に渡す条件（クローズ時に更新されるため since で期間外を除外できる）"""
+        return {"state": "closed", "labels": ["incident"], "since": self.start_date}
+
+    def is_past_cutoff(self, timestamp):
+        """降順に並んだ結果がこの日時に達したら以降は全て期間外"""
+        return timestamp < self.start_date
+
+    def in_window(self, timestamp):
+        """日時が集計期間内かどうか"""
+        return timestamp is not None and self.start_date <= timestamp <= self.end_date
+
+    def take_until_cutoff(self, items, sort_key):
+        """
+        降順に並んだページング結果を期間の開始日時を過ぎたところで打ち切ります
+        PaginatedList は読み進めた分だけページを取得するため、以降のページは要求されません
+        """
+        for item in items:
+            if self.is_past_cutoff(sort_key(item)):
+                logger.debug(f"Stopping paginated listing at cutoff {self.start_date}")
+                return
+            yield item
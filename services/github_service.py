@@ -1,30 +1,233 @@
 import os
+import time
 import logging
-from datetime import datetime, timedelta
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib3.util.retry import Retry
 from github import Github
 from github.GithubException import GithubException
+from services.client_pool import ClientPool
+from services.duration_sketch import DurationSketch
+from services.github_query_plan import GitHubQueryPlan
+from services.instrumentation import registry, record_upstream_response
+from services.request_scheduler import github_request_scheduler, rate_limit_resource
 
 logger = logging.getLogger(__name__)
 
+# リポジトリ単位の取得を並列に行うスレッド数のデフォルト値
+DEFAULT_FETCH_WORKERS = 8
+FETCH_WORKERS = max(1, int(os.environ.get('GITHUB_FETCH_WORKERS', DEFAULT_FETCH_WORKERS)))
+
+# GitHub Enterprise や検証用サーバーを使う場合は GITHUB_API_URL で切り替える
+GITHUB_API_URL = os.environ.get('GITHUB_API_URL', 'https://api.github.com')
+
+# REST APIの1ページあたりの取得件数（APIの上限値）
+PAGE_SIZE = 100
+
+# PyGithub組み込みの待ち時間（デフォルトは全リクエスト0.25秒・書き込み1秒で、GraphQLのPOSTも書き込み扱い）
+# ペースはレート制限のヘッダーを見る RequestBudget で調整するため、デフォルトでは無効にする
+SECONDS_BETWEEN_REQUESTS = float(os.environ.get('GITHUB_SECONDS_BETWEEN_REQUESTS', 0)) or None
+SECONDS_BETWEEN_WRITES = float(os.environ.get('GITHUB_SECONDS_BETWEEN_WRITES', 0)) or None
+
+# 接続エラー・5xxだけを再試行する（レート制限の 403 / 429 は RequestBudget で扱う）
+HTTP_RETRY = Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504), allowed_methods=None)
+
+# 収集するイベントの種類
+EVENT_KINDS = ("deployments", "pull_requests", "incidents")
+
+# 1回のGraphQLクエリで取得するデプロイメント数
+DEPLOYMENT_BATCH_SIZE = 50
+
+# デプロイメントとそのステータスをまとめて取得するGraphQLクエリ
+DEPLOYMENTS_QUERY = """
+query($owner: String!, $name: String!, $first: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    deployments(first: $first, after: $cursor, orderBy: {field: CREATED_AT, direction: DESC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        databaseId
+        createdAt
+        statuses(first: 100) { nodes { state } }
+      }
+    }
+  }
+}
+"""
+
+def _parse_graphql_datetime(value):
+    """GraphQL APIの ISO 8601 形式の日時を naive UTC に変換"""
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+
+def _thread_local_attribute(name):
+    return property(
+        lambda self: getattr(self._pending, name),
+        lambda self, value: setattr(self._pending, name, value)
+    )
+
+def _install_thread_local_connection(requester):
+    """
+    永続接続はリポジトリ取得のスレッド間で共有される。PyGithubは request() で受け取った内容を
+    接続に保持して getresponse() で送るため、スレッドごとに分けないと別のスレッドのリクエストを送ってしまう
+    クライアントごとに接続クラスを、送る内容をスレッドごとに保持するサブクラスに置き換える
+    """
+    attribute = "_Requester__connectionClass"
+    base = getattr(requester, attribute)
+
+    class ThreadLocalConnection(base):
+        verb = _thread_local_attribute("verb")
+        url = _thread_local_attribute("url")
+        input = _thread_local_attribute("input")
+        headers = _thread_local_attribute("headers")
+
+        def __init__(self, *args, **kwargs):
+            self._pending = threading.local()
+            super().__init__(*args, **kwargs)
+
+    setattr(requester, attribute, ThreadLocalConnection)
+
+def _to_naive_utc(value):
+    """PyGithubが返すタイムゾーン付き日時を utcnow() と比較できる naive UTC に揃える"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def _validate_github_client(github):
+    """トークンが有効か確認（プールから定期的に呼ばれる）"""
+    try:
+        github.get_user().login
+        logger.info("Successfully authenticated with GitHub")
+        return True
+    except GithubException as e:
+        logger.error(f"Failed to authenticate with GitHub: {str(e)}")
+        return False
+
+def _install_request_hooks(requester, token):
+    """
+    リクエストごとにレート制限の予算を確認し、応答のヘッダーで予算と計測値を更新します
+    予算は REST・GraphQL など GitHub が別々に数える種類ごとに分け、URLから選ぶ
+    二次レート制限は待ち時間が短ければ待ってから再送する
+    PyGithubは接続クラスの差し替えをクラス単位（永続接続が無効になる）でしか公開していないため、
+    クライアントごとに接続クラスをサブクラスに置き換える
+    """
+    attribute = "_Requester__connectionClass"
+    base = getattr(requester, attribute)
+
+    class ScheduledConnection(base):
+        def getresponse(self):
+            budget = github_request_scheduler.budget(token, rate_limit_resource(self.url))
+            retries = 0
+            while True:
+                budget.acquire()
+                started = time.perf_counter()
+                response = super().getresponse()
+                record_upstream_response(
+                    'github', self.verb, response.status, time.perf_counter() - started, response.headers
+                )
+                retry_after = budget.update(response.status, response.headers, response.text if response.status >= 400 else None)
+                if retry_after is None or retry_after > budget.max_wait or retries >= github_request_scheduler.max_retries:
+                    return response
+                retries += 1
+
+    setattr(requester, attribute, ScheduledConnection)
+
+def _create_github_client(token):
+    github = Github(
+        token,
+        base_url=GITHUB_API_URL,
+        per_page=PAGE_SIZE,
+        retry=HTTP_RETRY,
+        # 並列に取得するスレッドがそれぞれ接続を保持できるようにする（urllib3 のデフォルトは10本）
+        pool_size=FETCH_WORKERS,
+        seconds_between_requests=SECONDS_BETWEEN_REQUESTS,
+        seconds_between_writes=SECONDS_BETWEEN_WRITES
+    )
+    _install_thread_local_connection(github.requester)
+    _install_request_hooks(github.requester, token)
+    return github
+
+github_client_pool = ClientPool(
+    "GitHub",
+    factory=_create_github_client,
+    validate=_validate_github_client,
+    close=lambda github: github.close(),
+    idle_timeout=int(os.environ.get('GITHUB_CLIENT_IDLE_TIMEOUT', 1800)),
+    validate_interval=int(os.environ.get('GITHUB_TOKEN_VALIDATE_INTERVAL', 3600))
+)
+
+def lead_time_days(pr):
+    """プルリクエストの作成からマージまでの日数"""
+    return (pr["merged_at"] - pr["created_at"]).total_seconds() / 86400
+
+def restore_time_hours(incident):
+    """インシデントの発生からクローズまでの時間"""
+    return (incident["closed_at"] - incident["created_at"]).total_seconds() / 3600
+
+class FourKeysStats:
+    """
+    Four Keysメトリクスの中間集計（保持するのは件数とスケッチのみ）
+    リポジトリ・日ごとに計算して保存し、ユーザーが参照できるリポジトリ・集計期間の分をマージして使う
+    - デプロイメント数・失敗したデプロイメント数
+    - リードタイム・復旧時間の分位点スケッチ
+    """
+
+    def __init__(self):
+        self.deployments = 0
+        self.failed_deployments = 0
+        self.lead_time = DurationSketch()
+        self.time_to_restore = DurationSketch()
+
+    def add(self, kind, event):
+        if kind == "deployments":
+            self.deployments += 1
+            self.failed_deployments += 1 if event["failed"] else 0
+        elif kind == "pull_requests":
+            self.lead_time.add(lead_time_days(event))
+        else:
+            self.time_to_restore.add(restore_time_hours(event))
+
+    def merge(self, other):
+        self.deployments += other.deployments
+        self.failed_deployments += other.failed_deployments
+        self.lead_time.merge(other.lead_time)
+        self.time_to_restore.merge(other.time_to_restore)
+        return self
+
+    def copy(self):
+        return FourKeysStats().merge(self)
+
+    def to_dict(self):
+        return {
+            "d": self.deployments,
+            "f": self.failed_deployments,
+            "lt": self.lead_time.to_dict(),
+            "tr": self.time_to_restore.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        stats = cls()
+        stats.deployments = values["d"]
+        stats.failed_deployments = values["f"]
+        stats.lead_time = DurationSketch.from_dict(values["lt"])
+        stats.time_to_restore = DurationSketch.from_dict(values["tr"])
+        return stats
+
 class GitHubService:
-    def __init__(self, token=None):
+    def __init__(self, token=None, max_workers=None):
         self.token = token or os.environ.get('GITHUB_TOKEN')
+        self.max_workers = max(1, int(max_workers or FETCH_WORKERS))
         if self.token:
-            try:
-                self.github = Github(self.token)
-                # Test connection
-                self.github.get_user().login
-                logger.info("Successfully authenticated with GitHub")
-            except GithubException as e:
-                logger.error(f"Failed to authenticate with GitHub: {str(e)}")
-                self.github = None
+            # 認証済みクライアントをプールから再利用する
+            self.github = github_client_pool.get(self.token)
         else:
             logger.warning("No GitHub token provided")
             self.github = None
 
-    def get_four_keys_metrics(self):
+    def get_four_keys_metrics(self, window_days=30):
         """
-        Four Keysメトリクスを取得します
+        過去 window_days 日間のFour Keysメトリクスを取得します
         - デプロイメント頻度
         - リードタイム
         - 変更失敗率
@@ -35,15 +238,18 @@ class GitHubService:
             return self._get_empty_metrics()
 
         try:
-            # 過去30日間のメトリクスを計算
             end_date = datetime.utcnow()
-            start_date = end_date - timedelta(days=30)
+            start_date = end_date - timedelta(days=window_days)
+
+            # リポジトリの走査は1回だけ行い、4つの計算で同じイベントを共有する
+            events, incomplete_repos = self._crawl_events(start_date, end_date)
 
-            metrics = {
-                "deployment_frequency": self._get_deployment_frequency(start_date, end_date),
-                "lead_time": self._get_lead_time(start_date, end_date),
-                "change_failure_rate": self._get_change_failure_rate(start_date, end_date),
-                "time_to_restore": self._get_time_to_restore(start_date, end_date)
+            # レート制限などで取得できなかったリポジトリがあっても、取得できた分で計算して部分的な結果と明示する
+            metrics = self.calculate_metrics(events, start_date, end_date)
+            metrics["freshness"] = {
+                "status": "partial" if incomplete_repos else "fresh",
+                "as_of": end_date.isoformat(),
+                "pending": incomplete_repos
             }
             logger.info(f"Successfully fetched GitHub metrics: {metrics}")
             return metrics
@@ -51,24 +257,265 @@ class GitHubService:
             logger.error(f"Error fetching GitHub metrics: {str(e)}")
             return self._get_empty_metrics()
 
-    def _get_deployment_frequency(self, start_date, end_date):
-        """デプロイメント頻度を計算"""
-        if not self.github:
-            return {"value": 0, "unit": "per day"}
+    @classmethod
+    def calculate_metrics(cls, events, start_date, end_date):
+        """収集済みのイベント（APIまたはローカルストア）からFour Keysメトリクスを計算"""
+        return {
+            "deployment_frequency": cls._get_deployment_frequency(events, start_date, end_date),
+            "lead_time": cls._get_lead_time(events, start_date, end_date),
+            "change_failure_rate": cls._get_change_failure_rate(events, start_date, end_date),
+            "time_to_restore": cls._get_time_to_restore(events, start_date, end_date)
+        }
 
-        try:
-            total_deployments = 0
-            user = self.github.get_user()
-            for repo in user.get_repos():
-                try:
-                    deployments = repo.get_deployments()
-                    for deployment in deployments:
-                        if start_date <= deployment.created_at <= end_date:
-                            total_deployments += 1
-                except GithubException as e:
-                    logger.warning(f"Error fetching deployments for repo {repo.name}: {str(e)}")
+    @staticmethod
+    @registry.timed("calculator_duration_seconds", source='github', calculator='from_stats')
+    def calculate_metrics_from_stats(stats, start_date, end_date):
+        """リポジトリごとの中間集計をマージした FourKeysStats からFour Keysメトリクスを計算"""
+        days = (end_date - start_date).days or 1
+        failure_rate = stats.failed_deployments / stats.deployments * 100 if stats.deployments > 0 else 0
+        return {
+            "deployment_frequency": {"value": round(stats.deployments / days, 2), "unit": "per day"},
+            "lead_time": dict(stats.lead_time.summary(), unit="days"),
+            "change_failure_rate": {"value": round(failure_rate, 2), "unit": "percent"},
+            "time_to_restore": dict(stats.time_to_restore.summary(), unit="hours")
+        }
+
+    def _crawl_events(self, start_date, end_date):
+        """
+        全リポジトリを1回だけ走査し、期間内のイベントを収集します
+        - deployments: デプロイメント（失敗ステータスの有無を含む）
+        - pull_requests: マージ済みのプルリクエスト
+        - incidents: クローズ済みの incident Issue
+        戻り値: (イベント, 一部のイベント種別を取得できなかったリポジトリ数)
+        """
+        plan = GitHubQueryPlan(start_date, end_date)
+        events = {kind: [] for kind in EVENT_KINDS}
+        incomplete_repos = 0
+        user = self.github.get_user()
+        for repo_events in self._map_repos(user.get_repos(), self._fetch_repo_events, plan):
+            if len(repo_events) < len(EVENT_KINDS):
+                incomplete_repos += 1
+            for kind, items in repo_events.items():
+                events[kind].extend(items)
+
+        logger.debug(
+            f"Crawled GitHub events: {len(events['deployments'])} deployments, "
+            f"{len(events['pull_requests'])} pull requests, {len(events['incidents'])} incidents "
+            f"({incomplete_repos} repos incomplete)"
+        )
+        return events, incomplete_repos
+
+    def _map_repos(self, repos, fetch, *args):
+        """
+        リポジトリごとの取得処理を max_workers 本のスレッドで並列に実行します
+        max_workers が1の場合は従来通り逐次実行します
+        """
+        if self.max_workers == 1:
+            for repo in repos:
+                yield fetch(repo, *args)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="github-fetch") as executor:
+            # ページングされた get_repos() の読み出しと並行して取得を開始する
+            # リクエストの優先度（request_priority）をワーカースレッドにも引き継ぐ
+            futures = [executor.submit(contextvars.copy_context().run, fetch, repo, *args) for repo in repos]
+            for future in futures:
+                yield future.result()
+
+    def _fetch_repo_events(self, repo, plan, kinds=EVENT_KINDS):
+        """
+        1つのリポジトリから期間内のイベントを取得します
+        取得に失敗した（レート制限で見送った場合を含む）イベント種別は戻り値に含めない
+        """
+        fetchers = {
+            "deployments": self._fetch_deployments,
+            "pull_requests": self._fetch_merged_pulls,
+            "incidents": self._fetch_incidents
+        }
+        events = {}
+        for kind in kinds:
+            try:
+                with registry.timer("upstream_fetch_duration_seconds", source='github', kind=kind):
+                    events[kind] = fetchers[kind](repo, plan)
+            except GithubException as e:
+                logger.warning(f"Error fetching {kind} for repo {repo.name}: {str(e)}")
+        return events
+
+    def _fetch_merged_pulls(self, repo, plan):
+        """期間内にマージされたプルリクエストを取得"""
+        merged_pulls = []
+        pulls = repo.get_pulls(**plan.pulls_query())
+        # 更新日時の降順なので、期間開始より前に更新されたPRが現れたら打ち切る
+        for pr in plan.take_until_cutoff(pulls, lambda pr: _to_naive_utc(pr.updated_at)):
+            # 一覧APIの応答には merged が含まれず、参照するとPRごとに追加のリクエストが発生する
+            if pr.merged_at is None:
+                continue
+            merged_at = _to_naive_utc(pr.merged_at)
+            if plan.in_window(merged_at):
+                merged_pulls.append({
+                    "repo": repo.full_name,
+                    "number": pr.number,
+                    "created_at": _to_naive_utc(pr.created_at),
+                    "merged_at": merged_at
+                })
+        return merged_pulls
+
+    def _fetch_incidents(self, repo, plan):
+        """期間内にクローズされた incident Issue を取得"""
+        incidents = []
+        for issue in repo.get_issues(**plan.incidents_query()):
+            closed_at = _to_naive_utc(issue.closed_at)
+            if plan.in_window(closed_at):
+                incidents.append({
+                    "repo": repo.full_name,
+                    "number": issue.number,
+                    "created_at": _to_naive_utc(issue.created_at),
+                    "closed_at": closed_at
+                })
+        return incidents
+
+    def list_repositories(self):
+        """ユーザーが参照できるリポジトリの一覧"""
+        return list(self.github.get_user().get_repos())
+
+    def fetch_incremental_events(self, repos, watermarks, default_since, end_date):
+        """
+        前回の同期以降に追加されたイベントだけを取得します
+        watermarks: {(リポジトリ名, イベント種別): {"since": 日時, "etag": ETag, "recheck_since": 日時またはNone}}
+        recheck_since がある種別は、一覧が変わっていなくてもその日時以降を取り直す
+        （デプロイメントのステータスは後から追加されても一覧の先頭ページが変わらないため）
+        戻り値: [{"repo", "kind", "changed", "etag", "events"}]
+        """
+        results = []
+        for repo_results in self._map_repos(repos, self._fetch_repo_changes, watermarks, default_since, end_date):
+            results.extend(repo_results)
+        return results
+
+    def _fetch_repo_changes(self, repo, watermarks, default_since, end_date):
+        """
+        イベント種別ごとに条件付きリクエストで変化を確認し、変化があれば since 以降を取得します
+        304 Not Modified の応答はレート制限を消費しない
+        """
+        results = []
+        for kind in EVENT_KINDS:
+            watermark = watermarks.get((repo.full_name, kind), {})
+            try:
+                changed, etag = self._check_listing_changed(repo, kind, watermark.get("etag"))
+            except GithubException as e:
+                logger.warning(f"Error checking {kind} for repo {repo.name}: {str(e)}")
+                continue
+
+            result = {"repo": repo.full_name, "kind": kind, "changed": changed, "etag": etag, "events": []}
+            since = (watermark.get("since") or default_since) if changed else watermark.get("recheck_since")
+            if since is not None:
+                plan = GitHubQueryPlan(since, end_date)
+                fetched = self._fetch_repo_events(repo, plan, kinds=(kind,))
+                if kind not in fetched:
+                    # 取得できなかった種別は同期済み位置を進めず、次回の同期で取り直す
                     continue
+                result["events"] = fetched[kind]
+            results.append(result)
+        return results
+
+    def fetch_event_ranges(self, ranges):
+        """
+        リポジトリ・イベント種別ごとに指定した期間のイベントを取得します（バックフィル用）
+        ranges: [(リポジトリ, イベント種別, 開始日時, 終了日時)]
+        戻り値: [{"repo", "kind", "complete", "events"}]（取得できなかった範囲は complete=False）
+        """
+        return list(self._map_repos(ranges, self._fetch_event_range))
+
+    def _fetch_event_range(self, event_range):
+        repo, kind, start_date, end_date = event_range
+        fetched = self._fetch_repo_events(repo, GitHubQueryPlan(start_date, end_date), kinds=(kind,))
+        return {"repo": repo.full_name, "kind": kind, "complete": kind in fetched, "events": fetched.get(kind, [])}
+
+    def _check_listing_changed(self, repo, kind, etag):
+        """一覧APIの先頭ページのETagを比較して変化の有無を返す"""
+        listings = {
+            "deployments": ("/deployments", {}),
+            "pull_requests": ("/pulls", {"state": "closed", "sort": "updated", "direction": "desc"}),
+            # 古い incident がクローズされても先頭ページが変わるよう、更新日時の降順にする
+            "incidents": ("/issues", {"state": "closed", "labels": "incident", "sort": "updated", "direction": "desc"})
+        }
+        path, parameters = listings[kind]
+        headers = {"If-None-Match": etag} if etag else {}
+        status, response_headers, output = self.github.requester.requestJson(
+            "GET", repo.url + path, parameters=dict(parameters, per_page=1), headers=headers
+        )
+        if status == 304:
+            return False, etag
+        if status >= 400:
+            raise GithubException(status, output, response_headers)
+        return True, response_headers.get("etag")
 
+    def _fetch_deployments(self, repo, plan):
+        """
+        期間内のデプロイメントを失敗ステータスの有無と合わせて取得します
+        GraphQLでデプロイメントとステータスをバッチ取得し、
+        GraphQLが使えない場合のみデプロイメントごとのREST呼び出しに切り替えます
+        """
+        try:
+            return self._fetch_deployments_graphql(repo, plan)
+        except GithubException as e:
+            logger.warning(f"GraphQL deployment query failed for repo {repo.name}, falling back to REST: {str(e)}")
+            return self._fetch_deployments_rest(repo, plan)
+
+    def _fetch_deployments_graphql(self, repo, plan):
+        """GraphQLでデプロイメントとステータスを DEPLOYMENT_BATCH_SIZE 件ずつ取得"""
+        deployments = []
+        variables = {
+            "owner": repo.owner.login,
+            "name": repo.name,
+            "first": DEPLOYMENT_BATCH_SIZE,
+            "cursor": None
+        }
+        while True:
+            _, data = self.github.requester.graphql_query(DEPLOYMENTS_QUERY, variables)
+            connection = data["data"]["repository"]["deployments"]
+            reached_cutoff = False
+            for node in connection["nodes"]:
+                created_at = _parse_graphql_datetime(node["createdAt"])
+                # 作成日時の降順なので期間開始より古いものが現れたら以降のページは不要
+                if plan.is_past_cutoff(created_at):
+                    reached_cutoff = True
+                    break
+                if plan.in_window(created_at):
+                    deployments.append({
+                        "repo": repo.full_name,
+                        "id": node["databaseId"],
+                        "created_at": created_at,
+                        # GraphQLのステータスは大文字の列挙値で返る
+                        "failed": any(status["state"] == 'FAILURE' for status in node["statuses"]["nodes"])
+                    })
+
+            if reached_cutoff or not connection["pageInfo"]["hasNextPage"]:
+                break
+            variables["cursor"] = connection["pageInfo"]["endCursor"]
+        return deployments
+
+    def _fetch_deployments_rest(self, repo, plan):
+        """REST APIでデプロイメントごとにステータスを取得"""
+        deployments = []
+        # REST APIのデプロイメント一覧も作成日時の降順で返る
+        for deployment in plan.take_until_cutoff(repo.get_deployments(), lambda d: _to_naive_utc(d.created_at)):
+            created_at = _to_naive_utc(deployment.created_at)
+            if plan.in_window(created_at):
+                statuses = deployment.get_statuses()
+                deployments.append({
+                    "repo": repo.full_name,
+                    "id": deployment.id,
+                    "created_at": created_at,
+                    "failed": any(status.state == 'failure' for status in statuses)
+                })
+        return deployments
+
+    @staticmethod
+    @registry.timed("calculator_duration_seconds", source='github', calculator='deployment_frequency')
+    def _get_deployment_frequency(events, start_date, end_date):
+        """デプロイメント頻度を計算"""
+        try:
+            total_deployments = len(events["deployments"])
             days = (end_date - start_date).days or 1
             frequency = total_deployments / days
             return {"value": round(frequency, 2), "unit": "per day"}
@@ -76,56 +523,26 @@ class GitHubService:
             logger.error(f"Error calculating deployment frequency: {str(e)}")
             return {"value": 0, "unit": "per day"}
 
-    def _get_lead_time(self, start_date, end_date):
-        """コード変更のリードタイムを計算"""
-        if not self.github:
-            return {"value": 0, "unit": "days"}
-
+    @staticmethod
+    @registry.timed("calculator_duration_seconds", source='github', calculator='lead_time')
+    def _get_lead_time(events, start_date, end_date):
+        """コード変更のリードタイム（平均と p50 / p90 / p99）を計算"""
         try:
-            total_lead_time = 0
-            total_prs = 0
-            user = self.github.get_user()
-
-            for repo in user.get_repos():
-                try:
-                    pulls = repo.get_pulls(state='closed', sort='updated', direction='desc')
-                    for pr in pulls:
-                        if pr.merged and start_date <= pr.merged_at <= end_date:
-                            lead_time = (pr.merged_at - pr.created_at).total_seconds() / 86400
-                            total_lead_time += lead_time
-                            total_prs += 1
-                except GithubException as e:
-                    logger.warning(f"Error fetching pull requests for repo {repo.name}: {str(e)}")
-                    continue
-
-            average_lead_time = total_lead_time / total_prs if total_prs > 0 else 0
-            return {"value": round(average_lead_time, 2), "unit": "days"}
+            sketch = DurationSketch()
+            for pr in events["pull_requests"]:
+                sketch.add(lead_time_days(pr))
+            return dict(sketch.summary(), unit="days")
         except Exception as e:
             logger.error(f"Error calculating lead time: {str(e)}")
             return {"value": 0, "unit": "days"}
 
-    def _get_change_failure_rate(self, start_date, end_date):
+    @staticmethod
+    @registry.timed("calculator_duration_seconds", source='github', calculator='change_failure_rate')
+    def _get_change_failure_rate(events, start_date, end_date):
         """変更失敗率を計算"""
-        if not self.github:
-            return {"value": 0, "unit": "percent"}
-
         try:
-            total_deployments = 0
-            failed_deployments = 0
-            user = self.github.get_user()
-
-            for repo in user.get_repos():
-                try:
-                    deployments = repo.get_deployments()
-                    for deployment in deployments:
-                        if start_date <= deployment.created_at <= end_date:
-                            total_deployments += 1
-                            statuses = deployment.get_statuses()
-                            if any(status.state == 'failure' for status in statuses):
-                                failed_deployments += 1
-                except GithubException as e:
-                    logger.warning(f"Error fetching deployment statuses for repo {repo.name}: {str(e)}")
-                    continue
+            total_deployments = len(events["deployments"])
+            failed_deployments = sum(1 for deployment in events["deployments"] if deployment["failed"])
 
             failure_rate = (failed_deployments / total_deployments * 100) if total_deployments > 0 else 0
             return {"value": round(failure_rate, 2), "unit": "percent"}
@@ -133,35 +550,21 @@ class GitHubService:
             logger.error(f"Error calculating change failure rate: {str(e)}")
             return {"value": 0, "unit": "percent"}
 
-    def _get_time_to_restore(self, start_date, end_date):
-        """サービス復旧時間を計算"""
-        if not self.github:
-            return {"value": 0, "unit": "hours"}
-
+    @staticmethod
+    @registry.timed("calculator_duration_seconds", source='github', calculator='time_to_restore')
+    def _get_time_to_restore(events, start_date, end_date):
+        """サービス復旧時間（平均と p50 / p90 / p99）を計算"""
         try:
-            total_restore_time = 0
-            total_incidents = 0
-            user = self.github.get_user()
-
-            for repo in user.get_repos():
-                try:
-                    issues = repo.get_issues(state='closed', labels=['incident'])
-                    for issue in issues:
-                        if start_date <= issue.closed_at <= end_date:
-                            restore_time = (issue.closed_at - issue.created_at).total_seconds() / 3600
-                            total_restore_time += restore_time
-                            total_incidents += 1
-                except GithubException as e:
-                    logger.warning(f"Error fetching incidents for repo {repo.name}: {str(e)}")
-                    continue
-
-            average_restore_time = total_restore_time / total_incidents if total_incidents > 0 else 0
-            return {"value": round(average_restore_time, 2), "unit": "hours"}
+            sketch = DurationSketch()
+            for incident in events["incidents"]:
+                sketch.add(restore_time_hours(incident))
+            return dict(sketch.summary(), unit="hours")
         except Exception as e:
             logger.error(f"Error calculating time to restore: {str(e)}")
             return {"value": 0, "unit": "hours"}
 
-    def _get_empty_metrics(self):
+    @staticmethod
+    def _get_empty_metrics():
         """メトリクスの初期値を返す"""
         return {
             "deployment_frequency": {"value": 0, "unit": "per day"},
@@ -0,0 +1,215 @@
+import os
+import io
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# 所要時間のヒストグラムのバケット境界（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+    """
+    プロセス内のカウンタ・ゲージ・ヒストグラムを保持し、Prometheusのテキスト形式で出力します
+    - メトリクスは事前に宣言し、ラベルの組み合わせごとに値を持つ
+    - 記録は1回のロック取得と加算だけなので計算・通信の経路に置いても負荷は小さい
+    """
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self._metrics = {}  # name -> {"type", "help", "buckets", "samples": {labels: value}}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        self._declare(name, "counter", help_text)
+
+    def gauge(self, name, help_text):
+        self._declare(name, "gauge", help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self._declare(name, "histogram", help_text, buckets)
+
+    def _declare(self, name, metric_type, help_text, buckets=None):
+        with self._lock:
+            self._metrics[name] = {"type": metric_type, "help": help_text, "buckets": buckets, "samples": {}}
+
+    def inc(self, name, amount=1, **labels):
+        """カウンタを加算"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            samples = self._metrics[name]["samples"]
+            samples[key] = samples.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """ゲージの値を設定"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._metrics[name]["samples"][key] = value
+
+    def observe(self, name, value, **labels):
+        """ヒストグラムに値を1件追加"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            metric = self._metrics[name]
+            sample = metric["samples"].get(key)
+            if sample is None:
+                sample = metric["samples"][key] = {"buckets": [0] * len(metric["buckets"]), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(metric["buckets"]):
+                if value <= bound:
+                    sample["buckets"][i] += 1
+            sample["sum"] += value
+            sample["count"] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """with ブロックの所要時間をヒストグラムに記録（例外で抜けた場合も記録する）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name, **labels):
+        """関数の所要時間をヒストグラムに記録するデコレーター"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def value(self, name, **labels):
+        """現在の値（カウンタ・ゲージ）を返す"""
+        with self._lock:
+            return self._metrics[name]["samples"].get(tuple(sorted(labels.items())))
+
+    def render(self):
+        """Prometheusのテキスト形式（version 0.0.4）で出力"""
+        lines = []
+        with self._lock:
+            for name, metric in sorted(self._metrics.items()):
+                full_name = f"{self.namespace}_{name}"
+                lines.append(f"# HELP {full_name} {metric['help']}")
+                lines.append(f"# TYPE {full_name} {metric['type']}")
+                for labels, sample in sorted(metric["samples"].items()):
+                    if metric["type"] != "histogram":
+                        lines.append(f"{full_name}{_format_labels(labels)} {_format_value(sample)}")
+                        continue
+                    for bound, count in zip(metric["buckets"], sample["buckets"]):
+                        lines.append(f"{full_name}_bucket{_format_labels(labels, [('le', _format_value(bound))])} {count}")
+                    lines.append(f"{full_name}_bucket{_format_labels(labels, [('le', '+Inf')])} {sample['count']}")
+                    lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(sample['sum'])}")
+                    lines.append(f"{full_name}_count{_format_labels(labels)} {sample['count']}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry("engineering_metrics")
+
+registry.histogram("http_request_duration_seconds", "Time spent handling HTTP requests.")
+registry.histogram("calculator_duration_seconds", "Time spent in metric calculators.")
+registry.histogram("sync_duration_seconds", "Time spent syncing upstream events into the local store.")
+registry.histogram("upstream_fetch_duration_seconds", "Time spent fetching one kind of event from one repository.")
+registry.histogram("upstream_request_duration_seconds", "Latency of individual upstream API requests.")
+registry.counter("upstream_requests_total", "Upstream API requests by source, method and status.")
+registry.gauge("github_rate_limit_remaining", "Remaining GitHub API requests in the current window.")
+registry.gauge("github_rate_limit_limit", "GitHub API request limit of the current window.")
+registry.gauge("github_rate_limit_reset_timestamp_seconds", "Unix time when the GitHub rate limit window resets.")
+registry.counter("upstream_requests_deferred_total", "Upstream requests not sent because the rate limit budget was exhausted.")
+registry.counter("upstream_secondary_rate_limits_total", "Secondary rate limit responses received from upstream.")
+registry.counter("metrics_cache_requests_total", "Metrics cache lookups by result (hit, stale, miss, wait).")
+registry.gauge("stream_subscribers", "Open metric stream (Server-Sent Events) connections.")
+registry.counter("profiled_requests_total", "Requests profiled by the opt-in request profiler.")
+registry.counter("webhook_events_total", "Webhook deliveries by source, event and result.")
+registry.counter("markdown_blocks_total", "Markdown preview blocks by cache result (hit, miss).")
+
+def record_upstream_response(source, method, status, seconds, headers=None):
+    """上流APIへの1リクエストを記録し、GitHubの場合はレート制限の残数も更新する"""
+    registry.inc("upstream_requests_total", source=source, method=method.upper(), status=str(status))
+    registry.observe("upstream_request_duration_seconds", seconds, source=source)
+    if source != 'github' or not headers:
+        return
+
+    headers = {name.lower(): value for name, value in headers.items()}
+    resource = headers.get("x-ratelimit-resource", "core")
+    gauges = {
+        "x-ratelimit-remaining": "github_rate_limit_remaining",
+        "x-ratelimit-limit": "github_rate_limit_limit",
+        "x-ratelimit-reset": "github_rate_limit_reset_timestamp_seconds"
+    }
+    for header, name in gauges.items():
+        if header in headers:
+            try:
+                registry.set(name, int(headers[header]), resource=resource)
+            except ValueError:
+                pass
+
+def instrument_requests_session(session, source):
+    """requests のセッションに応答フックを追加し、リクエストごとの件数・所要時間を記録"""
+    def record(response, *args, **kwargs):
+        record_upstream_response(
+            source, response.request.method, response.status_code, response.elapsed.total_seconds(), response.headers
+        )
+    session.hooks["response"].append(record)
+
+class RequestProfiler:
+    """
+    指定したリクエストを cProfile で計測し、閾値より遅ければ関数ごとの内訳をログに出力します
+    PROFILE_REQUESTS=1 のときだけ有効で、?profile=1 を付けたリクエストが対象
+    同時に計測するのは1リクエストだけ
+    """
+
+    def __init__(self, enabled, threshold_seconds, endpoints, limit=40):
+        self.enabled = enabled
+        self.threshold_seconds = threshold_seconds
+        self.endpoints = set(endpoints)
+        self.limit = limit
+        self._lock = threading.Lock()
+
+    def start(self, endpoint, requested):
+        """計測を開始し、開始できた場合はプロファイラを返す"""
+        if not (self.enabled and requested and endpoint in self.endpoints):
+            return None
+        if not self._lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def stop(self, profiler, endpoint, seconds):
+        """計測を終了し、閾値を超えていれば内訳を出力"""
+        profiler.disable()
+        self._lock.release()
+        registry.inc("profiled_requests_total", endpoint=endpoint)
+        if seconds < self.threshold_seconds:
+            return None
+
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(self.limit)
+        report = output.getvalue()
+        logger.warning(f"Slow request to {endpoint} took {seconds:.3f}s, profile:\n{report}")
+        return report
+
+request_profiler = RequestProfiler(
+    enabled=os.environ.get('PROFILE_REQUESTS', '0') == '1',
+    threshold_seconds=float(os.environ.get('PROFILE_SLOW_REQUEST_SECONDS', 1.0)),
+    endpoints=os.environ.get('PROFILE_ENDPOINTS', 'dashboard').split(',')
+)
@@ -1,47 +1,315 @@
-from jira import JIRA
-from datetime import datetime, timedelta
+from jira import JIRA, JIRAError
+from datetime import datetime, timedelta, timezone
+import logging
 import os
+import requests
+from services.client_pool import ClientPool
+from services.instrumentation import registry, instrument_requests_session
+from services.sliding_window import DailyBuckets, window_start_day, boundary_range
+
+logger = logging.getLogger(__name__)
+
+# search_issues の1ページあたりの取得件数
+PAGE_SIZE = 100
+
+# メトリクス計算に必要なフィールドだけを要求する
+# - 完了率・平均解決時間: created, resolutiondate
+# - バックログ健全性: updated, resolutiondate, status
+METRIC_FIELDS = ["created", "updated", "resolutiondate", "status"]
+
+# ローカルストアへの同期ではプロジェクトも保存する
+ISSUE_FIELDS = ["project"] + METRIC_FIELDS
+
+# この日数より長く更新されていない未解決Issueを滞留とみなす
+BACKLOG_STALE_DAYS = 30
+
+def _parse_jira_datetime(value):
+    """Jiraの日時（例: 2024-01-01T10:00:00.000+0900）を naive UTC に変換"""
+    if not value:
+        return None
+    parsed = datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f%z")
+    return parsed.astimezone(timezone.utc).replace(tzinfo=None)
+
+class JiraIssueStats:
+    """
+    Issueを1件ずつ受け取りながらJiraメトリクスを集計します（保持するのは件数と合計のみ）
+    - チケット完了率: 期間内に作成されたIssueのうち解決済みの割合
+    - 平均解決時間: 期間内に解決されたIssueの作成から解決までの平均日数
+    - バックログ健全性: 未解決Issueのうち直近 BACKLOG_STALE_DAYS 日以内に更新されたものの割合
+    """
+
+    def __init__(self, start_date, end_date):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.stale_before = end_date - timedelta(days=BACKLOG_STALE_DAYS)
+        self.created = 0
+        self.created_resolved = 0
+        self.resolved = 0
+        self.total_resolution_days = 0
+        self.open = 0
+        self.open_fresh = 0
+
+    def add(self, issue):
+        created_at = issue["created_at"]
+        resolved_at = issue["resolved_at"]
+        if created_at and self.start_date <= created_at <= self.end_date:
+            self.created += 1
+            if resolved_at and resolved_at <= self.end_date:
+                self.created_resolved += 1
+        if resolved_at and self.start_date <= resolved_at <= self.end_date:
+            self.resolved += 1
+            self.total_resolution_days += (resolved_at - created_at).total_seconds() / 86400
+        if resolved_at is None and issue["status_category"] != 'done':
+            self.open += 1
+            if issue["updated_at"] and issue["updated_at"] >= self.stale_before:
+                self.open_fresh += 1
+
+    def completion_rate(self):
+        return self.created_resolved / self.created * 100 if self.created > 0 else 0
+
+    def average_resolution_days(self):
+        return self.total_resolution_days / self.resolved if self.resolved > 0 else 0
+
+    def backlog_health(self):
+        return self.open_fresh / self.open * 100 if self.open > 0 else 0
+
+class JiraIssueCounts:
+    """JiraIssueStats の件数のうち、日ごとに合計できるもの（作成日・解決日ごとの集計）"""
+
+    def __init__(self):
+        self.created = 0
+        self.created_resolved = 0
+        self.resolved = 0
+        self.total_resolution_days = 0
+
+    def add_created(self, resolved):
+        self.created += 1
+        if resolved:
+            self.created_resolved += 1
+
+    def add_resolved(self, resolution_days):
+        self.resolved += 1
+        self.total_resolution_days += resolution_days
+
+    def merge(self, other):
+        self.created += other.created
+        self.created_resolved += other.created_resolved
+        self.resolved += other.resolved
+        self.total_resolution_days += other.total_resolution_days
+        return self
+
+    def copy(self):
+        return JiraIssueCounts().merge(self)
+
+def _create_jira_client(key):
+    server_url, token = key
+    # get_server_info=False で生成時にサーバーへ問い合わせない
+    jira = JIRA(
+        server=server_url,
+        token_auth=token,
+        get_server_info=False
+    )
+    instrument_requests_session(jira._session, 'jira')
+    return jira
+
+def _validate_jira_client(jira):
+    """トークンが有効か確認（プールから定期的に呼ばれる）"""
+    try:
+        jira.myself()
+        return True
+    except (JIRAError, requests.exceptions.RequestException) as e:
+        logger.error(f"Failed to authenticate with Jira: {str(e)}")
+        return False
+
+jira_client_pool = ClientPool(
+    "Jira",
+    factory=_create_jira_client,
+    validate=_validate_jira_client,
+    close=lambda jira: jira.close(),
+    idle_timeout=int(os.environ.get('JIRA_CLIENT_IDLE_TIMEOUT', 1800)),
+    validate_interval=int(os.environ.get('JIRA_TOKEN_VALIDATE_INTERVAL', 3600))
+)
 
 class JiraService:
     def __init__(self, token):
         self.token = token
         self.server_url = os.environ.get('JIRA_SERVER_URL', 'https://your-domain.atlassian.net')
         if token:
-            self.jira = JIRA(
-                server=self.server_url,
-                token_auth=token
-            )
+            # 認証済みクライアントをプールから再利用する
+            self.jira = jira_client_pool.get((self.server_url, token))
         else:
             self.jira = None
 
-    def get_metrics(self):
+    def get_metrics(self, window_days=30):
         if not self.jira:
-            return {
-                "ticket_completion_rate": {"value": 0, "unit": "percent"},
-                "average_resolution_time": {"value": 0, "unit": "days"},
-                "backlog_health": {"value": 0, "unit": "score"}
-            }
+            return self._get_empty_metrics()
 
-        # Calculate metrics for the last 30 days
+        # Calculate metrics for the last window_days days
         end_date = datetime.utcnow()
-        start_date = end_date - timedelta(days=30)
+        start_date = end_date - timedelta(days=window_days)
 
-        metrics = {
-            "ticket_completion_rate": self._get_ticket_completion_rate(start_date, end_date),
-            "average_resolution_time": self._get_average_resolution_time(start_date, end_date),
-            "backlog_health": self._get_backlog_health()
-        }
+        try:
+            # 3つのメトリクスに必要なIssueを1回のJQLでページングしながら集計する
+            jql = f'created >= -{window_days}d OR resolved >= -{window_days}d OR resolution = Unresolved'
+            stats = self._aggregate(self._iter_issue_events(jql, METRIC_FIELDS), start_date, end_date)
+
+            metrics = {
+                "ticket_completion_rate": self._get_ticket_completion_rate(stats),
+                "average_resolution_time": self._get_average_resolution_time(stats),
+                "backlog_health": self._get_backlog_health(stats)
+            }
+            logger.info(f"Successfully fetched Jira metrics: {metrics}")
+            return metrics
+        except (JIRAError, requests.exceptions.RequestException) as e:
+            logger.error(f"Error fetching Jira metrics: {str(e)}")
+            return self._get_empty_metrics()
 
+    @classmethod
+    @registry.timed("calculator_duration_seconds", source='jira', calculator='by_window')
+    def calculate_metrics_by_window(cls, issues, windows, end_date):
+        """
+        Issueを1回走査し、複数の集計期間のJiraメトリクスをまとめて計算します（{日数: メトリクス}）
+        作成・解決の件数は日ごとに集計し、期間ごとに新しい日から合計する
+        期間の最初の日は途中から始まるため、その日の期間内の分は期間ごとに別に数える
+        """
+        start_date = window_start_day(end_date, max(windows))
+        buckets = DailyBuckets(JiraIssueCounts)
+        ranges = {window_days: boundary_range(end_date, window_days) for window_days in windows}
+        boundaries = {window_days: JiraIssueCounts() for window_days in windows}
+
+        def counts_for(timestamp):
+            yield buckets.bucket(timestamp)
+            for window_days, (boundary_start, boundary_end) in ranges.items():
+                if boundary_start <= timestamp < boundary_end:
+                    yield boundaries[window_days]
+
+        backlog = JiraIssueStats(start_date, end_date)
+        for issue in issues:
+            created_at = issue["created_at"]
+            resolved_at = issue["resolved_at"]
+            if created_at and start_date <= created_at <= end_date:
+                for counts in counts_for(created_at):
+                    counts.add_created(bool(resolved_at and resolved_at <= end_date))
+            if resolved_at and start_date <= resolved_at <= end_date:
+                for counts in counts_for(resolved_at):
+                    counts.add_resolved((resolved_at - created_at).total_seconds() / 86400)
+            # 未解決のIssueは集計期間に依存しない
+            if resolved_at is None and issue["status_category"] != 'done':
+                backlog.add(issue)
+
+        metrics = {}
+        for window_days, counts in buckets.windows(windows, end_date, boundaries.get).items():
+            stats = JiraIssueStats(end_date - timedelta(days=window_days), end_date)
+            stats.created = counts.created
+            stats.created_resolved = counts.created_resolved
+            stats.resolved = counts.resolved
+            stats.total_resolution_days = counts.total_resolution_days
+            stats.open = backlog.open
+            stats.open_fresh = backlog.open_fresh
+            metrics[window_days] = {
+                "ticket_completion_rate": cls._get_ticket_completion_rate(stats),
+                "average_resolution_time": cls._get_average_resolution_time(stats),
+                "backlog_health": cls._get_backlog_health(stats)
+            }
         return metrics
 
-    def _get_ticket_completion_rate(self, start_date, end_date):
-        # Implementation for ticket completion rate calculation
-        return {"value": 0, "unit": "percent"}
+    @staticmethod
+    @registry.timed("calculator_duration_seconds", source='jira', calculator='aggregate')
+    def _aggregate(issues, start_date, end_date):
+        stats = JiraIssueStats(start_date, end_date)
+        for issue in issues:
+            stats.add(issue)
+        return stats
+
+    def iter_updated_issues(self, since, include_unresolved=False):
+        """
+        since 以降に更新されたIssueを更新日時の昇順で1件ずつ返します
+        JQLの相対指定（-Nm）を使い、サーバーとのタイムゾーン差の影響を受けないようにする
+        include_unresolved: 長く更新されていない未解決のIssueも含める（初回の同期用。バックログの健全性に必要）
+        """
+        minutes = int((datetime.utcnow() - since).total_seconds() // 60) + 1
+        condition = f'updated >= "-{minutes}m"'
+        if include_unresolved:
+            condition = f'({condition} OR resolution = Unresolved)'
+        return self._iter_issue_events(f'{condition} ORDER BY updated ASC', ISSUE_FIELDS)
 
-    def _get_average_resolution_time(self, start_date, end_date):
-        # Implementation for average resolution time calculation
-        return {"value": 0, "unit": "days"}
+    def _iter_issue_events(self, jql, fields):
+        """
+        search_issues をページングしながらIssueを1件ずつ返します（保持するのは1ページ分のみ）
+        完了済みなのに解決日時がないIssueがあれば、そのページ分だけ変更履歴を展開して補う
+        """
+        start_at = 0
+        while True:
+            page = self.jira.search_issues(
+                jql, startAt=start_at, maxResults=PAGE_SIZE, fields=fields, json_result=True
+            )
+            issues = [self._to_issue_event(issue) for issue in page.get("issues", [])]
+            self._fill_resolved_from_changelog(issues)
+            yield from issues
+
+            start_at += len(issues)
+            if not issues or start_at >= page.get("total", 0):
+                break
+
+    def _fill_resolved_from_changelog(self, issues):
+        """
+        解決日時（resolution）を設定しないワークフロー向けに、
+        完了ステータスへの最後の遷移日時を解決日時として使う
+        """
+        missing = {issue["key"]: issue for issue in issues
+                   if issue["resolved_at"] is None and issue["status_category"] == 'done'}
+        if not missing:
+            return
+
+        keys = ", ".join(missing)
+        page = self.jira.search_issues(
+            f"key in ({keys})", maxResults=len(missing), fields=["status"], expand="changelog", json_result=True
+        )
+        for issue in page.get("issues", []):
+            histories = (issue.get("changelog") or {}).get("histories", [])
+            status_changes = [
+                history["created"] for history in histories
+                if any(item.get("field") == "status" for item in history.get("items", []))
+            ]
+            if status_changes and issue["key"] in missing:
+                missing[issue["key"]]["resolved_at"] = max(_parse_jira_datetime(created) for created in status_changes)
+
+    @staticmethod
+    def _to_issue_event(issue):
+        fields = issue["fields"]
+        status = fields.get("status") or {}
+        return {
+            "key": issue["key"],
+            "project": (fields.get("project") or {}).get("key") or issue["key"].split("-")[0],
+            "created_at": _parse_jira_datetime(fields.get("created")),
+            "updated_at": _parse_jira_datetime(fields.get("updated")),
+            "resolved_at": _parse_jira_datetime(fields.get("resolutiondate")),
+            "status_category": (status.get("statusCategory") or {}).get("key")
+        }
+
+    @staticmethod
+    @registry.timed("calculator_duration_seconds", source='jira', calculator='ticket_completion_rate')
+    def _get_ticket_completion_rate(stats):
+        """期間内に作成されたIssueのうち解決済みの割合"""
+        return {"value": round(stats.completion_rate(), 2), "unit": "percent"}
+
+    @staticmethod
+    @registry.timed("calculator_duration_seconds", source='jira', calculator='average_resolution_time')
+    def _get_average_resolution_time(stats):
+        """期間内に解決されたIssueの平均解決日数"""
+        return {"value": round(stats.average_resolution_days(), 2), "unit": "days"}
 
-    def _get_backlog_health(self):
-        # Implementation for backlog health calculation
-        return {"value": 0, "unit": "score"}
\ No newline at end of file
+    @staticmethod
+    @registry.timed("calculator_duration_seconds", source='jira', calculator='backlog_health')
+    def _get_backlog_health(stats):
+        """未解決Issueのうち滞留していないものの割合"""
+        return {"value": round(stats.backlog_health(), 2), "unit": "score"}
+
+    @staticmethod
+    def _get_empty_metrics():
+        """メトリクスの初期値を返す"""
+        return {
+            "ticket_completion_rate": {"value": 0, "unit": "percent"},
+            "average_resolution_time": {"value": 0, "unit": "days"},
+            "backlog_health": {"value": 0, "unit": "score"}
+        }
@@ -0,0 +1,376 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+import markdown
+from markdown.blockprocessors import HashHeaderProcessor, HRProcessor, SetextHeaderProcessor
+from markdown.extensions.fenced_code import FencedBlockPreprocessor
+from services.instrumentation import registry
+
+logger = logging.getLogger(__name__)
+
+MARKDOWN_EXTENSIONS = ['fenced_code', 'tables']
+
+# 表の判定に使う（表は参照リンクの定義より先に処理されるため、表の中の定義はただの文字列になる）
+TABLE_PROCESSOR = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS).parser.blockprocessors['table']
+
+# リストの項目・引用（空行をはさんで続くものは1つのリスト・引用として描画される）
+LIST_ITEM_PATTERN = re.compile(r'^ {0,3}([*+-]|\d+[.)])\s+')
+BLOCKQUOTE_PATTERN = re.compile(r'^ {0,3}>')
+QUOTE_MARKER_PATTERN = re.compile(r'^( {0,3}> ?)+')
+
+# 参照リンクの定義（文書のどこに書いても他のブロックから参照される）
+# 判定は markdown の ReferenceProcessor と同じ式で行う（URL・タイトルは次の行に書いてもよい）
+REFERENCE_PATTERN = re.compile(r'^ {0,3}\[[^\[\]]*\]:')
+REFERENCE_DEFINITION_PATTERN = re.compile(
+    r'''^[ ]{0,3}\[([^\[\]]*)\]:[ ]*\n?[ ]*([^\s]+)[ ]*(?:\n[ ]*)?((["'])(.*)\4[ ]*|\((.*)\)[ ]*)?$''',
+    re.MULTILINE
+)
+
+# 行頭のブロックレベルの HTML タグ（閉じタグまでは空行をはさんでも1つの HTML として描画される）
+HTML_BLOCK_TAGS = (
+    'address|article|aside|blockquote|body|canvas|colgroup|dd|details|div|dl|dt|fieldset|figcaption|figure|'
+    'footer|form|h[1-6]|header|hgroup|html|iframe|legend|li|main|map|math|menu|nav|noscript|object|ol|option|'
+    'output|p|pre|progress|script|section|style|summary|table|tbody|td|textarea|tfoot|th|thead|tr|ul|video'
+)
+HTML_BLOCK_PATTERN = re.compile(rf'^ {{0,3}}<({HTML_BLOCK_TAGS})(?=[\s/>]|$)', re.IGNORECASE)
+COMMENT_PATTERN = re.compile(r'^ {0,3}<!--')
+
+class PreviewOutOfSync(Exception):
+    """差分の元になる内容がサーバーに無い（クライアントは全文を送り直す）"""
+
+def split_blocks(lines):
+    """
+    Markdownの行を、単独で描画しても結果が変わらないブロックに分けます
+    - 空行で区切る（フェンス・HTML のブロック・HTML のコメントの中の空行では区切らない）
+    - インデントされた行（リストの続きなど）と、空行をはさんだリストの項目・引用は直前のブロックにつなげる
+      （間にある参照リンクの定義は描画されないので、その前のブロックまでまとめてつなげる）
+    - 閉じない HTML のコメントより後では HTML が解釈されないため、文書の最後までを1つのブロックにする
+    戻り値: (ブロックの行のリストのリスト, ブロックごとの参照リンクの定義（1行に書き直したもの）のリスト)
+    """
+    fences = _closed_fences(lines)
+    to_end_from = _unclosed_comment_line(lines, fences)
+    # 引用の中（空行までの続きの行を含む）は > を除いた内容で参照リンクの定義を探す
+    unquoted = [QUOTE_MARKER_PATTERN.sub('', line) if '>' in line else line for line in lines]
+    in_quote = False
+    # 表は markdown が処理する塊の先頭でだけ始まる（空行・見出し・区切り線・定義・フェンスの後など）
+    chunk_start = True
+    in_table = False
+    blocks = []  # (前の空行の数, 行のリスト, 参照リンクの定義のリスト, 定義の行数)
+    current = []
+    definitions = []
+    definition_lines = 0
+    gap = blanks = 0
+    html_tag = None  # 閉じていない HTML のブロックのタグ名
+    html_depth = 0
+    in_comment = False
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        # HTML のブロックの中で閉じないコメントが始まると、文書の最後まで HTML として扱われる
+        in_html = html_tag is not None or (in_comment and index < to_end_from)
+        if not in_html and line.strip() and definition_lines == len(current):
+            if not current:
+                gap, blanks = blanks, 0
+            gap, current, definitions, definition_lines = _join_continued(
+                blocks, (gap, current, definitions, definition_lines), line
+            )
+        if index in fences:
+            # fenced_code は HTML より先に処理されるため、HTML のブロックやコメントの中でもフェンスを優先する
+            current.extend(lines[index:fences[index] + 1])
+            index = fences[index] + 1
+            chunk_start, in_table, in_quote = True, False, False
+            continue
+        index += 1
+        if in_html:
+            current.append(line)
+            if index > to_end_from:
+                continue
+            # コメントの中の閉じタグでは HTML のブロックは終わらない
+            visible, in_comment = _split_comments(line, in_comment)
+            if html_tag is not None:
+                html_depth += _tag_depth(html_tag, visible)
+                if html_depth <= 0:
+                    html_tag = None
+            continue
+
+        if not line.strip():
+            chunk_start, in_table = True, False
+        if not line.strip() and index <= to_end_from:
+            if current:
+                blocks.append((gap, current, definitions, definition_lines))
+                current, definitions, definition_lines = [], [], 0
+            blanks += 1
+            in_quote = False
+            continue
+
+        if not in_quote and not in_table and BLOCKQUOTE_PATTERN.match(line):
+            in_quote, chunk_start, in_table = True, True, False
+        source = unquoted if in_quote else lines
+        if not source[index - 1].strip():
+            chunk_start, in_table = True, False
+        # 表の見出しの行には必ず | がある
+        if chunk_start and not in_table and '|' in line and index < len(lines) and \
+                TABLE_PROCESSOR.test(None, '\n'.join(source[index - 1:index + 1])):
+            in_table = True
+        length, definition = (0, None) if in_table or not line.strip() else \
+            _match_definition(source, index - 1, fences, to_end_from, chunk_start)
+        if length:
+            definitions.append(definition)
+            if not in_quote:
+                # 引用の中の定義も空の引用として描画されるため、定義だけのブロックとしては扱わない
+                definition_lines += length
+            current.extend(lines[index - 1:index - 1 + length])
+            index += length - 1
+            chunk_start = True
+            continue
+        # 見出し・区切り線の後と、塊の先頭のインデントされたコードの後からは新しい塊になる
+        # （> の無い見出し・区切り線は引用の中の表も終わらせ、後の行は引用の続きにもならない）
+        if _ends_chunk(source[index - 1]) and (not in_table or (in_quote and not BLOCKQUOTE_PATTERN.match(line))):
+            chunk_start, in_table = True, False
+            in_quote = in_quote and bool(BLOCKQUOTE_PATTERN.match(line))
+        elif not in_table:
+            chunk_start = chunk_start and source[index - 1].startswith(('    ', '\t'))
+        if index <= to_end_from:
+            html = HTML_BLOCK_PATTERN.match(line)
+            visible, in_comment = _split_comments(line, False)
+            if html:
+                html_depth = _tag_depth(html.group(1), visible)
+                if html_depth > 0:
+                    html_tag = html.group(1)
+            if html or COMMENT_PATTERN.match(line):
+                # HTML のブロックは取り出されて別の塊になる（引用の続きにもならない）
+                chunk_start, in_table, in_quote = True, False, False
+        current.append(line)
+
+    if current:
+        blocks.append((gap, current, definitions, definition_lines))
+    return [block[1] for block in blocks], [block[2] for block in blocks]
+
+def _join_continued(blocks, current, line):
+    """
+    line が前のブロックの続きなら、そのブロックから current までを1つにまとめて返します
+    （current には参照リンクの定義だけが入っている。定義は描画されないので、その前のブロックの続きになる）
+    current・戻り値: (前の空行の数, 行のリスト, 参照リンクの定義のリスト, 定義の行数)
+    """
+    start = _continued_block(blocks, line) if blocks else None
+    if start is None:
+        return current
+    joined, definitions, definition_lines = [], [], 0
+    for gap, block, block_definitions, block_definition_lines in blocks[start:] + [current]:
+        if joined:
+            joined += [''] * gap
+        joined += block
+        definitions += block_definitions
+        definition_lines += block_definition_lines
+    gap = blocks[start][0]
+    del blocks[start:]
+    return gap, joined, definitions, definition_lines
+
+def _closed_fences(lines):
+    """閉じたフェンスの 開始行 -> 終了行（閉じないフェンスは fenced_code 拡張ではただの文字列）"""
+    fences = {}
+    line_starts = _line_starts(lines)
+    for match in FencedBlockPreprocessor.FENCED_BLOCK_RE.finditer('\n'.join(lines)):
+        fences[bisect_right(line_starts, match.start()) - 1] = bisect_right(line_starts, match.end() - 1) - 1
+    return fences
+
+def _unclosed_comment_line(lines, fences):
+    """閉じない HTML のコメントが始まる行（無ければ行数。フェンスの中は数えない）"""
+    masked = list(lines)
+    for start, end in fences.items():
+        masked[start:end + 1] = [''] * (end + 1 - start)
+    text = '\n'.join(masked)
+    position = text.find('<!--', text.rfind('-->') + 1)
+    if position < 0:
+        return len(lines)
+    return bisect_right(_line_starts(lines), position) - 1
+
+def _line_starts(lines):
+    starts = [0]
+    for line in lines[:-1]:
+        starts.append(starts[-1] + len(line) + 1)
+    return starts
+
+def _match_definition(lines, index, fences, to_end_from, chunk_start):
+    """
+    lines[index] から始まる参照リンクの定義の (行数, 1行に書き直した定義) を返します（定義でなければ (0, None)）
+    他のブロックに付けたときに前後の内容で解釈が変わらないよう、定義は1行に書き直す
+    """
+    if not REFERENCE_PATTERN.match(lines[index]):
+        return 0, None
+    text = '\n'.join(lines[index:index + 3])
+    match = REFERENCE_DEFINITION_PATTERN.match(text)
+    if not match:
+        return 0, None
+    # URL を次の行に書いた場合、その行が先に HTML・フェンス・見出し・区切り線・引用として処理されるなら定義ではない
+    if match.start(2) > len(lines[index]) and (
+            index + 1 in fences or (index + 1 < to_end_from and _starts_html(lines[index + 1]))
+            or _ends_chunk(lines[index + 1]) or BLOCKQUOTE_PATTERN.match(lines[index + 1])
+            or (chunk_start and SetextHeaderProcessor.RE.match('\n'.join(lines[index:index + 2])))):
+        return 0, None
+    length = text.count('\n', 0, match.end()) + 1
+    # タイトルを探して読み進めた空行は含めない
+    while not lines[index + length - 1].strip():
+        length -= 1
+    title = match.group(5) or match.group(6)
+    return length, f'[{match.group(1)}]: {match.group(2)}' + (f' "{title}"' if title else '')
+
+def _ends_chunk(line):
+    """見出し・区切り線の行か"""
+    if line.lstrip(' ')[:1] not in ('#', '-', '*', '_'):
+        return False
+    return bool(HashHeaderProcessor.RE.search(line) or HRProcessor.SEARCH_RE.search(line))
+
+def _starts_html(line):
+    return bool(HTML_BLOCK_PATTERN.match(line) or COMMENT_PATTERN.match(line))
+
+def _split_comments(line, in_comment):
+    """
+    (行の HTML のコメントの外の部分, 行の終わりで HTML のコメントが閉じていなければ True) を返します
+    大きめにつなげても結果は変わらないので、行のどこにあるコメントでも数える
+    """
+    if not in_comment and '<!--' not in line:
+        return line, False
+    visible = []
+    position = 0
+    while True:
+        marker = '-->' if in_comment else '<!--'
+        index = line.find(marker, position)
+        if not in_comment:
+            visible.append(line[position:index if index >= 0 else len(line)])
+        if index < 0:
+            return ''.join(visible), in_comment
+        position = index + len(marker)
+        in_comment = not in_comment
+
+def _tag_depth(tag, line):
+    """行の中で開いたタグの数から閉じたタグの数を引いたもの"""
+    opened = len(re.findall(rf'<{tag}(?=[\s>]|$)', line, re.IGNORECASE))
+    closed = len(re.findall(rf'</{tag}\s*>', line, re.IGNORECASE))
+    return opened - closed
+
+def _continued_block(blocks, line):
+    """line をつなげるブロックの位置（つなげない場合は None）"""
+    for index in range(len(blocks) - 1, -1, -1):
+        _, block, _, definition_lines = blocks[index]
+        if definition_lines < len(block):
+            return index if _continues(block, line) else None
+    return len(blocks) - 1 if _continues(blocks[-1][1], line) else None
+
+def _continues(block, line):
+    if line[0] in ' \t':
+        return True
+    # 大きめにつなげても結果は変わらない（キャッシュの単位が大きくなるだけ）ので、ブロック内のどこかに同じ種類の行があればつなげる
+    return any(
+        pattern.match(line) and any(pattern.match(previous) for previous in block)
+        for pattern in (LIST_ITEM_PATTERN, BLOCKQUOTE_PATTERN)
+    )
+
+class MarkdownRenderer:
+    """
+    Markdownをブロックごとに描画し、結果をブロックの内容のハッシュでキャッシュします
+    - 編集されていないブロックはキャッシュから返すため、文書が長くなっても変わったブロックだけ描画する
+    - 拡張を読み込んだ Markdown インスタンスを使い回す（スレッドセーフではないためロックする）
+    - 件数の上限を超えたら最も長く使われていないブロックから削除する
+    """
+
+    def __init__(self, max_blocks=4096):
+        self.max_blocks = max_blocks
+        self._converter = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+        self._cache = OrderedDict()  # ハッシュ -> HTML
+        self._lock = threading.Lock()
+
+    def render(self, lines):
+        blocks, block_definitions = split_blocks(lines)
+        # ブロック index の定義は definitions[offsets[index]:offsets[index + 1]]
+        definitions, offsets = [], [0]
+        for block in block_definitions:
+            definitions += block
+            offsets.append(len(definitions))
+        html = []
+        for index, block in enumerate(blocks):
+            text = '\n'.join(block)
+            # 参照リンクを使うかもしれないブロックだけ、他のブロックの定義を付けて描画する
+            # （定義の変更で関係のないブロックまで描画し直さない）
+            # 同じ名前の定義は後のものが使われるため、文書の順になるよう前後に置く
+            if '[' in text:
+                before = definitions[:offsets[index]]
+                after = definitions[offsets[index + 1]:]
+                if before:
+                    text = '\n'.join(before) + '\n\n' + text
+                if after:
+                    text += '\n\n' + '\n'.join(after)
+            html.append(self._render_block(text))
+        return '\n'.join(part for part in html if part)
+
+    def _render_block(self, text):
+        key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        with self._lock:
+            html = self._cache.get(key)
+            if html is not None:
+                self._cache.move_to_end(key)
+                registry.inc("markdown_blocks_total", result="hit")
+                return html
+
+            registry.inc("markdown_blocks_total", result="miss")
+            html = self._converter.reset().convert(text)
+            self._cache[key] = html
+            while len(self._cache) > self.max_blocks:
+                self._cache.popitem(last=False)
+            return html
+
+class PreviewDocuments:
+    """
+    プレビュー中の文書の内容を保持し、クライアントから送られた行単位の差分を適用します
+    - キーは (ユーザーID, 文書ID)。反映するたびにリビジョンを1つ進める
+    - 件数の上限を超えたら最も長く更新されていない文書から削除する（クライアントは全文を送り直す）
+    """
+
+    def __init__(self, max_documents=256):
+        self.max_documents = max_documents
+        self._documents = OrderedDict()  # key -> (リビジョン, 行のリスト)
+        self._lock = threading.Lock()
+
+    def replace(self, key, content):
+        """全文で置き換え、(リビジョン, 行のリスト) を返す"""
+        with self._lock:
+            previous = self._documents.get(key)
+            revision = previous[0] + 1 if previous else 1
+            return self._store(key, revision, content.split('\n'))
+
+    def apply(self, key, revision, changes):
+        """
+        revision の内容に差分を順に適用し、(リビジョン, 行のリスト) を返します
+        changes: [{"start": 最初の行, "delete": 削除する行数, "lines": 挿入する行}, ...]
+        """
+        with self._lock:
+            document = self._documents.get(key)
+            if document is None or document[0] != revision:
+                raise PreviewOutOfSync(f"Preview document is not at revision {revision}")
+            lines = list(document[1])
+            for change in changes:
+                start, delete, inserted = change.get("start"), change.get("delete"), change.get("lines")
+                if (not isinstance(start, int) or not isinstance(delete, int) or not isinstance(inserted, list)
+                        or start < 0 or delete < 0 or start + delete > len(lines)):
+                    raise PreviewOutOfSync(f"Invalid change for revision {revision}: {change}")
+                lines[start:start + delete] = [str(line) for line in inserted]
+            return self._store(key, revision + 1, lines)
+
+    def _store(self, key, revision, lines):
+        self._documents[key] = (revision, lines)
+        self._documents.move_to_end(key)
+        while len(self._documents) > self.max_documents:
+            self._documents.popitem(last=False)
+        return revision, lines
+
+markdown_renderer = MarkdownRenderer(
+    max_blocks=int(os.environ.get('MARKDOWN_CACHE_MAX_BLOCKS', 4096))
+)
+
+preview_documents = PreviewDocuments(
+    max_documents=int(os.environ.get('MARKDOWN_PREVIEW_MAX_DOCUMENTS', 256))
+)
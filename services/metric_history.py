@@ -0,0 +1,205 @@
+import logging
+from datetime import datetime, timedelta
+from app import db
+from models import Metric, MetricRollup
+from services import bulk_write
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_GRANULARITIES = {
+    "day": timedelta(days=1),
+    "week": timedelta(days=7)
+}
+
+# 集計単位の区間が期間からはみ出す部分を読み込む1つ細かい単位（None は生データ）
+FINER_GRANULARITY = {
+    "week": "day",
+    "day": None
+}
+
+def _bucket_start(timestamp, granularity):
+    """日次は0時、週次は月曜0時にそろえる"""
+    day = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    return day
+
+def record_metrics(user_id, source, metrics, timestamp=None):
+    """
+    計算したメトリクスを Metric に保存し、日次・週次の集計値を更新します
+    metrics: {"lead_time": {"value": 1.2, "unit": "days"}, ...}
+    """
+    record_metrics_bulk([(user_id, source, metrics, timestamp)])
+
+def record_metrics_bulk(results):
+    """
+    複数ユーザー・ソースのメトリクスをまとめて保存します（バッチ処理向け）
+    Metric は1回の executemany で追加し、集計値は INSERT ... ON CONFLICT で加算する
+    results: [(ユーザーID, ソース, メトリクス, 時刻またはNone), ...]
+    """
+    now = datetime.utcnow()
+    rows = []
+    for user_id, source, metrics, timestamp in results:
+        for metric_type, metric in metrics.items():
+            # 集計期間ごとの比較（windows）などメトリクス以外の項目は保存しない
+            if not isinstance(metric, dict) or "value" not in metric:
+                continue
+            rows.append({
+                "user_id": user_id, "metric_type": metric_type, "value": float(metric["value"]),
+                "timestamp": timestamp or now, "source": source
+            })
+    if not rows:
+        return 0
+
+    db.session.execute(db.insert(Metric), rows)
+    _add_to_rollups(rows)
+    return len(rows)
+
+def _add_to_rollups(rows):
+    """Metric の行を日次・週次の集計値に加算"""
+    deltas = {}
+    for row in rows:
+        for granularity in ROLLUP_GRANULARITIES:
+            key = (row["user_id"], row["source"], row["metric_type"], granularity,
+                   _bucket_start(row["timestamp"], granularity))
+            deltas.setdefault(key, []).append(row["value"])
+
+    if bulk_write.supports_upsert():
+        _upsert_rollups(deltas)
+        return
+
+    # INSERT ... ON CONFLICT が使えない場合は、既存の集計値を1回のクエリで読み込んで更新する
+    existing = {}
+    users = {key[0] for key in deltas}
+    buckets = {key[4] for key in deltas}
+    for rollup in MetricRollup.query.filter(
+        MetricRollup.user_id.in_(users), MetricRollup.bucket_start.in_(buckets)
+    ):
+        existing[(rollup.user_id, rollup.source, rollup.metric_type, rollup.granularity, rollup.bucket_start)] = rollup
+
+    for key, values in deltas.items():
+        rollup = existing.get(key)
+        if rollup is None:
+            user_id, source, metric_type, granularity, bucket_start = key
+            rollup = MetricRollup(
+                user_id=user_id, source=source, metric_type=metric_type, granularity=granularity,
+                bucket_start=bucket_start, count=0, total=0
+            )
+            db.session.add(rollup)
+        rollup.count += len(values)
+        rollup.total += sum(values)
+        rollup.minimum = min(values) if rollup.minimum is None else min(rollup.minimum, *values)
+        rollup.maximum = max(values) if rollup.maximum is None else max(rollup.maximum, *values)
+
+def _upsert_rollups(deltas):
+    """集計値を読み込まずに加算する（同時に記録した別のプロセスの値も失われない）"""
+    rows = [
+        {
+            "user_id": user_id, "source": source, "metric_type": metric_type, "granularity": granularity,
+            "bucket_start": bucket_start, "count": len(values), "total": sum(values),
+            "minimum": min(values), "maximum": max(values)
+        }
+        for (user_id, source, metric_type, granularity, bucket_start), values in deltas.items()
+    ]
+    bulk_write.upsert(
+        MetricRollup, rows, ['user_id', 'source', 'metric_type', 'granularity', 'bucket_start'],
+        lambda excluded: {
+            "count": MetricRollup.count + excluded.count,
+            "total": MetricRollup.total + excluded.total,
+            "minimum": bulk_write.least(MetricRollup.minimum, excluded.minimum),
+            "maximum": bulk_write.greatest(MetricRollup.maximum, excluded.maximum)
+        }
+    )
+
+def _choose_granularity(start_date, end_date, points):
+    """1点あたりの幅に収まる最も粗い集計単位を選ぶ（1日未満なら生データ）"""
+    width = (end_date - start_date) / points
+    if width >= ROLLUP_GRANULARITIES["week"]:
+        return "week"
+    if width >= ROLLUP_GRANULARITIES["day"]:
+        return "day"
+    return None
+
+def _load_samples(user_id, source, metric_type, start_date, end_date, granularity, include_end=True):
+    """
+    (時刻, 件数, 合計) の列を返す（include_end が False なら end_date ちょうどの値は含めない）
+    期間に収まる区間だけ集計値を使い、はみ出す両端は1つ細かい単位で読み込む
+    """
+    if not include_end and start_date >= end_date:
+        return []
+    if granularity is None:
+        rows = db.session.query(Metric.timestamp, Metric.value).filter(
+            Metric.user_id == user_id,
+            Metric.metric_type == metric_type,
+            Metric.source == source,
+            Metric.timestamp >= start_date,
+            Metric.timestamp <= end_date if include_end else Metric.timestamp < end_date
+        ).order_by(Metric.timestamp)
+        return [(timestamp, 1, value) for timestamp, value in rows]
+
+    finer = FINER_GRANULARITY[granularity]
+    first = _bucket_start(start_date, granularity)
+    if first < start_date:
+        first += ROLLUP_GRANULARITIES[granularity]
+    last = _bucket_start(end_date, granularity)  # end_date を含む区間（期間からはみ出す）
+    if last < first:
+        return _load_samples(user_id, source, metric_type, start_date, end_date, finer, include_end)
+
+    rows = db.session.query(MetricRollup.bucket_start, MetricRollup.count, MetricRollup.total).filter(
+        MetricRollup.user_id == user_id,
+        MetricRollup.source == source,
+        MetricRollup.metric_type == metric_type,
+        MetricRollup.granularity == granularity,
+        MetricRollup.bucket_start >= first,
+        MetricRollup.bucket_start < last
+    ).order_by(MetricRollup.bucket_start)
+    return (
+        _load_samples(user_id, source, metric_type, start_date, first, finer, False)
+        + list(rows)
+        + _load_samples(user_id, source, metric_type, last, end_date, finer, include_end)
+    )
+
+def get_history(user_id, source, metric_type, start_date, end_date, points):
+    """
+    期間を points 個の等幅区間に分け、区間ごとの平均値を返します
+    値のない区間は value を None とする
+    """
+    points = max(1, points)
+    granularity = _choose_granularity(start_date, end_date, points)
+    width = (end_date - start_date) / points
+    counts = [0] * points
+    totals = [0.0] * points
+
+    for timestamp, count, total in _load_samples(user_id, source, metric_type, start_date, end_date, granularity):
+        index = min(points - 1, int((timestamp - start_date) / width))
+        counts[index] += count
+        totals[index] += total
+
+    return {
+        "metric_type": metric_type,
+        "source": source,
+        "granularity": granularity or "raw",
+        "points": [
+            {
+                "timestamp": (start_date + width * i).isoformat(),
+                "value": round(totals[i] / counts[i], 2) if counts[i] else None
+            }
+            for i in range(points)
+        ]
+    }
+
+def get_latest_values(user_id, source):
+    """最後に記録したメトリクスの値を返す（{metric_type: value}、記録が無ければ空）"""
+    latest = db.session.query(db.func.max(Metric.timestamp)).filter(
+        Metric.user_id == user_id,
+        Metric.source == source
+    ).scalar()
+    if latest is None:
+        return {}
+
+    rows = db.session.query(Metric.metric_type, Metric.value).filter(
+        Metric.user_id == user_id,
+        Metric.source == source,
+        Metric.timestamp == latest
+    )
+    return {metric_type: value for metric_type, value in rows}
@@ -0,0 +1,58 @@
+import os
+import queue
+import logging
+import threading
+from services.instrumentation import registry
+
+logger = logging.getLogger(__name__)
+
+class MetricsBroadcaster:
+    """
+    計算済みのメトリクスを、同じユーザーのすべての購読者（ブラウザのタブ）へ配信します
+    - 購読者ごとに上限付きのキューを持ち、読み出しが遅い購読者は古いメッセージから捨てる
+    - 計算はユーザーごとに1回で、結果だけを購読者の数だけ複製する
+    """
+
+    def __init__(self, queue_size=16):
+        self.queue_size = queue_size
+        self._subscribers = {}  # user_id -> set(queue.Queue)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            self._update_gauge()
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[user_id]
+            self._update_gauge()
+
+    def publish(self, user_id, message):
+        """ユーザーの全購読者にメッセージを送る（購読者がいなければ何もしない）"""
+        with self._lock:
+            subscriptions = list(self._subscribers.get(user_id, ()))
+        for subscription in subscriptions:
+            while True:
+                try:
+                    subscription.put_nowait(message)
+                    break
+                except queue.Full:
+                    try:
+                        subscription.get_nowait()
+                    except queue.Empty:
+                        pass
+        return len(subscriptions)
+
+    def _update_gauge(self):
+        registry.set("stream_subscribers", sum(len(subscriptions) for subscriptions in self._subscribers.values()))
+
+metrics_broadcaster = MetricsBroadcaster(
+    queue_size=int(os.environ.get('METRICS_STREAM_QUEUE_SIZE', 16))
+)
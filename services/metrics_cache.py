@@ -0,0 +1,146 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from services.instrumentation import registry
+
+logger = logging.getLogger(__name__)
+
+class MetricsCache:
+    """
+    メトリクス計算結果のサーバー側キャッシュ
+    - キーは (ユーザーID, ソース, 集計日数)
+    - TTL内の値はそのまま返し、TTLを過ぎた値も即座に返しつつバックグラウンドで1回だけ再計算する
+    - 同じキーへの同時リクエストは1回の計算結果を共有する
+    - 件数の上限を超えたら最も長く使われていないエントリから削除する
+    - 計算が終わるたびに登録されたリスナーへ (キー, 値) を通知する
+    """
+
+    def __init__(self, max_entries=256, max_workers=4):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, computed_at)
+        self._inflight = {}  # key -> Future
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="metrics-refresh")
+        self._listeners = []
+
+    def get(self, key, ttl, compute):
+        """キャッシュから値を取得し、無ければ compute() で計算して保存"""
+        with self._lock:
+            entry = self._lookup(key, ttl, compute)
+            if entry is not None:
+                return entry[0]
+
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                logger.debug(f"Metrics cache miss for {key}")
+                future = Future()
+                self._inflight[key] = future
+            registry.inc("metrics_cache_requests_total", result="miss" if owner else "wait")
+
+        if owner:
+            self._compute(key, compute, future)
+        return future.result()
+
+    def get_nowait(self, key, ttl, compute):
+        """
+        計算を待たずに値を返します
+        無ければバックグラウンドで compute() を開始して None を返す（結果はリスナーへ通知される）
+        """
+        with self._lock:
+            entry = self._lookup(key, ttl, compute)
+            if entry is not None:
+                return entry[0]
+
+            if key in self._inflight:
+                registry.inc("metrics_cache_requests_total", result="wait")
+                return None
+            logger.debug(f"Metrics cache miss for {key}, computing in background")
+            registry.inc("metrics_cache_requests_total", result="miss")
+            self._submit(key, compute)
+        return None
+
+    def _lookup(self, key, ttl, compute):
+        """
+        保存済みのエントリを返す（ロックを取得した状態で呼ぶ）
+        期限切れの場合もそのまま返し、再計算が走っていなければ1回だけ開始する
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        self._entries.move_to_end(key)
+        if time.monotonic() - entry[1] < ttl:
+            logger.debug(f"Metrics cache hit for {key}")
+            registry.inc("metrics_cache_requests_total", result="hit")
+            return entry
+
+        registry.inc("metrics_cache_requests_total", result="stale")
+        if key not in self._inflight:
+            logger.debug(f"Metrics cache stale for {key}, refreshing in background")
+            self._submit(key, compute)
+        return entry
+
+    def _submit(self, key, compute):
+        future = Future()
+        self._inflight[key] = future
+        self._executor.submit(self._compute, key, compute, future)
+
+    def refresh(self, key, compute):
+        """TTLに関係なくバックグラウンドで再計算する（計算中なら何もしない）"""
+        with self._lock:
+            if key not in self._inflight:
+                self._submit(key, compute)
+
+    def keys(self):
+        """保存済みのキーの一覧"""
+        with self._lock:
+            return list(self._entries)
+
+    def peek(self, key):
+        """計算を起こさずに保存済みの値を返す（無ければ None）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry is not None else None
+
+    def add_listener(self, listener):
+        """計算が終わるたびに listener(key, value) を呼び出す"""
+        self._listeners.append(listener)
+
+    def invalidate(self, key):
+        """エントリを削除し、次回の取得で再計算させる"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _compute(self, key, compute, future):
+        try:
+            value = compute()
+        except Exception as e:
+            logger.error(f"Error computing metrics for {key}: {str(e)}")
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            return
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                logger.debug(f"Evicted metrics cache entry {evicted}")
+            self._inflight.pop(key, None)
+        future.set_result(value)
+
+        for listener in self._listeners:
+            try:
+                listener(key, value)
+            except Exception as e:
+                logger.error(f"Error notifying metrics cache listener for {key}: {str(e)}")
+
+metrics_cache = MetricsCache(
+    max_entries=int(os.environ.get('METRICS_CACHE_MAX_ENTRIES', 256)),
+    max_workers=int(os.environ.get('METRICS_CACHE_WORKERS', 4))
+)
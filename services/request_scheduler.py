@@ -0,0 +1,189 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from github.GithubException import GithubException
+from services.instrumentation import registry
+
+logger = logging.getLogger(__name__)
+
+# リクエストの優先度（現在の集計期間のデータをバックフィルより優先する）
+PRIORITY_CURRENT = "current"
+PRIORITY_BACKFILL = "backfill"
+
+# 二次レート制限で Retry-After が無い場合の待ち時間（連続するたびに倍にする）
+SECONDARY_LIMIT_BACKOFF = 60
+MAX_SECONDARY_LIMIT_BACKOFF = 900
+
+# 二次レート制限を受けたときのリクエスト間隔（成功が続くと半分ずつ戻す）
+MIN_BACKOFF_INTERVAL = 0.5
+MAX_BACKOFF_INTERVAL = 10.0
+
+# 応答ヘッダーで上限が分かるまで仮定する1時間あたりの上限
+DEFAULT_RATE_LIMIT = 5000
+
+_priority = contextvars.ContextVar("request_priority", default=PRIORITY_CURRENT)
+
+@contextmanager
+def request_priority(priority):
+    """ブロック内で発行するリクエストの優先度を設定"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def current_priority():
+    return _priority.get()
+
+class RateLimitDeferred(GithubException):
+    """
+    レート制限の予算が足りないため発行を見送ったリクエスト
+    GithubException として扱えるため、既存のエラー処理でそのまま部分的な結果になる
+    """
+
+    def __init__(self, message):
+        super().__init__(429, {"message": message}, None)
+
+def _is_secondary_limit(status, headers, body=None):
+    """
+    429、Retry-After 付きの 403、本文が二次レート制限のメッセージの 403 を二次レート制限とみなす
+    権限不足の 403（SAML で保護された Organization、Resource not accessible など）にも
+    レート制限のヘッダーは付くため、残数だけでは判定しない（通常の GithubException としてリポジトリごとに扱う）
+    """
+    if status == 429:
+        return True
+    if status != 403:
+        return False
+    if "retry-after" in headers:
+        return True
+    return "secondary rate limit" in (body or "").lower()
+
+def rate_limit_resource(url):
+    """
+    リクエストが消費するレート制限の種類（x-ratelimit-resource と同じ名前）
+    GitHubは REST（core）・GraphQL・検索の上限を別々に数える
+    """
+    path = url.split("?", 1)[0].rstrip("/")
+    if path.endswith("/graphql"):
+        return "graphql"
+    if "/search/" in path + "/":
+        return "search"
+    return "core"
+
+class RequestBudget:
+    """
+    1つのトークン・レート制限の種類（core / graphql / search）の状態と、リクエストの発行可否を管理します
+    - 応答のレート制限ヘッダーで残数・リセット時刻を更新し、並列の発行分は楽観的に差し引く
+    - 残数が上限の backfill_reserve_ratio 以下ならバックフィルのリクエストは見送る（現在の期間の取得に残す）
+    - 二次レート制限を受けたら Retry-After（無ければ指数的に延ばした時間）まで止め、間隔を空けて再開する
+    - max_wait を超えて待つ必要がある場合は待たずに RateLimitDeferred を送出する
+    """
+
+    def __init__(self, backfill_reserve_ratio, max_wait):
+        self.backfill_reserve_ratio = backfill_reserve_ratio
+        self.max_wait = max_wait
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None
+        self.interval = 0.0
+        self.blocked_until = 0.0
+        self.secondary_hits = 0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """リクエストを1件発行する前に呼ぶ（必要なら待つ）"""
+        priority = current_priority()
+        with self._lock:
+            now = time.time()
+            if self.reset_at is not None and now >= self.reset_at:
+                # 新しいウィンドウの残数は次の応答で分かる
+                self.remaining = None
+                self.reset_at = None
+
+            reserve = 0
+            if priority == PRIORITY_BACKFILL:
+                # 上限が分かるまでは GitHub の通常の上限（5000回/時）を基準にする
+                reserve = int((self.limit or DEFAULT_RATE_LIMIT) * self.backfill_reserve_ratio)
+            if self.remaining is not None and self.remaining <= reserve:
+                self._defer(priority, f"rate limit budget exhausted ({self.remaining} left, resets at {self.reset_at})")
+
+            wait = max(self.blocked_until, self._next_slot) - now
+            if wait > self.max_wait:
+                self._defer(priority, f"rate limited for another {wait:.0f}s")
+
+            if self.remaining is not None:
+                self.remaining -= 1
+            self._next_slot = max(now, self._next_slot) + self.interval
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def _defer(self, priority, reason):
+        registry.inc("upstream_requests_deferred_total", source='github', priority=priority)
+        raise RateLimitDeferred(reason)
+
+    def update(self, status, headers, body=None):
+        """
+        応答のヘッダーで状態を更新します（body は二次レート制限の判定に使う）
+        二次レート制限だった場合は、再送までの待ち時間（秒）を返す
+        """
+        headers = {name.lower(): value for name, value in headers.items()}
+        with self._lock:
+            try:
+                if "x-ratelimit-remaining" in headers:
+                    self.remaining = int(float(headers["x-ratelimit-remaining"]))
+                if "x-ratelimit-limit" in headers:
+                    self.limit = int(float(headers["x-ratelimit-limit"]))
+                if "x-ratelimit-reset" in headers:
+                    self.reset_at = int(float(headers["x-ratelimit-reset"]))
+            except ValueError:
+                pass
+
+            if _is_secondary_limit(status, headers, body):
+                self.secondary_hits += 1
+                try:
+                    retry_after = int(headers["retry-after"])
+                except (KeyError, ValueError):
+                    retry_after = min(SECONDARY_LIMIT_BACKOFF * 2 ** (self.secondary_hits - 1), MAX_SECONDARY_LIMIT_BACKOFF)
+                self.blocked_until = max(self.blocked_until, time.time() + retry_after)
+                self.interval = min(max(self.interval * 2, MIN_BACKOFF_INTERVAL), MAX_BACKOFF_INTERVAL)
+                registry.inc("upstream_secondary_rate_limits_total", source='github')
+                logger.warning(f"GitHub secondary rate limit hit, backing off for {retry_after}s")
+                return retry_after
+
+            if status < 400:
+                self.secondary_hits = 0
+                self.interval = self.interval / 2 if self.interval >= MIN_BACKOFF_INTERVAL / 4 else 0.0
+            return None
+
+class RequestScheduler:
+    """
+    トークン・レート制限の種類ごとの RequestBudget を保持する
+    クライアントを作り直しても同じトークンの予算を引き継ぐ
+    """
+
+    def __init__(self, backfill_reserve_ratio, max_wait, max_retries):
+        self.backfill_reserve_ratio = backfill_reserve_ratio
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self._budgets = {}
+        self._lock = threading.Lock()
+
+    def budget(self, token, resource="core"):
+        key = (token, resource)
+        with self._lock:
+            budget = self._budgets.get(key)
+            if budget is None:
+                budget = RequestBudget(self.backfill_reserve_ratio, self.max_wait)
+                self._budgets[key] = budget
+            return budget
+
+github_request_scheduler = RequestScheduler(
+    backfill_reserve_ratio=float(os.environ.get('GITHUB_BACKFILL_RESERVE_RATIO', 0.2)),
+    max_wait=float(os.environ.get('GITHUB_RATE_LIMIT_MAX_WAIT', 30)),
+    max_retries=int(os.environ.get('GITHUB_SECONDARY_LIMIT_RETRIES', 2))
+)
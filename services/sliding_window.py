@@ -0,0 +1,79 @@
+import json
+from datetime import datetime, timedelta
+
+def day_start(timestamp):
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def window_start_day(end_date, window_days):
+    """集計期間の最初の日（期間はこの日の途中から始まる）"""
+    return day_start(end_date - timedelta(days=window_days))
+
+def boundary_range(end_date, window_days):
+    """集計期間の最初の日のうち期間に含まれる範囲 (開始日時, 翌日0時)"""
+    start = end_date - timedelta(days=window_days)
+    return start, day_start(start) + timedelta(days=1)
+
+class DailyBuckets:
+    """
+    日ごとの中間集計を保持し、複数の集計期間（7日・30日・90日など）の値をまとめて計算します
+    - 集計は merge() / copy() を持つ型（FourKeysStats など）で、日ごとに1つ持つ
+    - 集計期間の値は新しい日から順に1回だけマージして求めるため、期間の数が増えてもほとんど変わらない
+    - 時間が経っても各日の集計は変わらず、期間の始まりが進むだけなので作り直す必要はない
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.buckets = {}  # 日の0時 -> 集計
+
+    def bucket(self, timestamp):
+        """timestamp の日の集計（無ければ作る）"""
+        day = day_start(timestamp)
+        stats = self.buckets.get(day)
+        if stats is None:
+            stats = self.buckets[day] = self.factory()
+        return stats
+
+    def merge(self, other):
+        for day, stats in other.buckets.items():
+            self.bucket(day).merge(stats)
+        return self
+
+    def prune(self, first_day):
+        """first_day より前の日の集計を捨てる"""
+        for day in [day for day in self.buckets if day < first_day]:
+            del self.buckets[day]
+
+    def windows(self, windows, end_date, boundary):
+        """
+        {日数: 直近その日数分をマージした集計} を返します
+        期間の最初の日は途中から始まるため、その日の集計は使わず boundary(日数) の集計を加える
+        （boundary は boundary_range() の範囲だけを集計したものを返すこと。日の集計を丸ごと使うと最大1日分多くなる）
+        """
+        pending = sorted(set(windows))
+        results = {}
+        total = self.factory()
+        end_day = day_start(end_date)
+
+        def close(window_days):
+            results[window_days] = total.copy().merge(boundary(window_days))
+
+        for day in sorted((day for day in self.buckets if day <= end_day), reverse=True):
+            while pending and day <= window_start_day(end_date, pending[0]):
+                close(pending.pop(0))
+            total.merge(self.buckets[day])
+        for window_days in pending:
+            close(window_days)
+        return results
+
+    def to_json(self):
+        return json.dumps(
+            {day.strftime("%Y-%m-%d"): stats.to_dict() for day, stats in self.buckets.items()},
+            separators=(",", ":")
+        )
+
+    @classmethod
+    def from_json(cls, data, stats_class):
+        buckets = cls(stats_class)
+        for day, values in json.loads(data).items():
+            buckets.buckets[datetime.strptime(day, "%Y-%m-%d")] = stats_class.from_dict(values)
+        return buckets
@@ -0,0 +1,302 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from github.GithubException import GithubException
+from app import db
+from models import User
+from services import event_store, metric_history
+from services.instrumentation import registry
+from services.github_service import GitHubService, EVENT_KINDS
+from services.request_scheduler import request_priority, PRIORITY_BACKFILL
+from services.jira_service import JiraService
+
+logger = logging.getLogger(__name__)
+
+# 初回同期でさかのぼる日数（最長の集計期間より短くはしない）
+DEFAULT_BACKFILL_DAYS = max(int(os.environ.get('SYNC_BACKFILL_DAYS', 90)), max(event_store.METRIC_WINDOWS))
+
+# 前回の同期位置から少し重ねて取得し、取りこぼしを防ぐ
+SYNC_OVERLAP = timedelta(hours=1)
+
+# デプロイメントのステータスは作成後に追加されるため長めに重ねる
+DEPLOYMENT_STATUS_OVERLAP = timedelta(days=1)
+
+# Jira の Issue を保存するバッチサイズ
+JIRA_SAVE_BATCH_SIZE = 500
+
+# バックフィルの進捗（どこまでさかのぼって取得済みか）を記録するリソース名の接尾辞
+BACKFILL_SUFFIX = ":backfill"
+
+# この秒数以内に（他のユーザーの同期で）取得済みのリポジトリは取得を省略する
+REPO_SYNC_INTERVAL = int(os.environ.get('GITHUB_REPO_SYNC_INTERVAL', 300))
+
+# 他のユーザーが同期中のリポジトリの完了を待つ最大秒数
+REPO_SYNC_WAIT_TIMEOUT = int(os.environ.get('GITHUB_REPO_SYNC_WAIT_TIMEOUT', 120))
+
+class RepoSyncCoordinator:
+    """
+    同じリポジトリを複数のユーザーの同期が同時に取得しないよう調整します（プロセス内）
+    先に claim した同期だけが取得し、他の同期はその完了を待つ
+    """
+
+    def __init__(self):
+        self._inflight = {}  # リポジトリ名 -> threading.Event
+        self._lock = threading.Lock()
+
+    def claim(self, repo_names):
+        """取得を担当するリポジトリと、他の同期の完了を待つ Event のリストを返す"""
+        claimed, in_progress = set(), []
+        with self._lock:
+            for repo_name in repo_names:
+                event = self._inflight.get(repo_name)
+                if event is None:
+                    self._inflight[repo_name] = threading.Event()
+                    claimed.add(repo_name)
+                else:
+                    in_progress.append(event)
+        return claimed, in_progress
+
+    def release(self, repo_names):
+        with self._lock:
+            for repo_name in repo_names:
+                self._inflight.pop(repo_name).set()
+
+    @staticmethod
+    def wait(events, timeout):
+        deadline = time.monotonic() + timeout
+        for event in events:
+            event.wait(max(0, deadline - time.monotonic()))
+
+repo_sync_coordinator = RepoSyncCoordinator()
+
+class EventSyncService:
+    """
+    GitHub / Jira のイベントをローカルストアへ差分同期します
+    - リポジトリ・イベント種別ごとに同期済み位置とETagを保持する
+    - ETagで変化がなければ取得を省略し、変化があれば同期済み位置以降だけを取得する
+    - 初回は現在の集計期間（window_days）だけを先に取得し、それより前は優先度の低いバックフィルで埋める
+    """
+
+    def __init__(self, user, backfill_days=DEFAULT_BACKFILL_DAYS, window_days=30):
+        self.user = user
+        self.backfill_days = backfill_days
+        self.window_days = min(window_days, backfill_days)
+
+    def sync(self, source):
+        """指定したソースを同期"""
+        if source == 'github':
+            return self.sync_github()
+        return self.sync_jira()
+
+    def sync_github(self):
+        """
+        GitHubのデプロイメント・マージ済みPR・インシデントを同期します
+        イベントはリポジトリ単位でユーザー間で共有するため、
+        他のユーザーの同期で REPO_SYNC_INTERVAL 以内に取得済みのリポジトリや、同期中のリポジトリは取得しない
+        """
+        github_service = GitHubService(self.user.github_token)
+        if not github_service.github:
+            return 0
+
+        try:
+            # 参照できるリポジトリの確認は、取得を省略する場合もユーザーごとに毎回行う
+            repos = github_service.list_repositories()
+            repo_names = [repo.full_name for repo in repos]
+            event_store.set_scope_access(self.user.id, 'github', repo_names, replace=True)
+            db.session.commit()
+        except GithubException as e:
+            db.session.rollback()
+            logger.error(f"Error listing GitHub repositories for user {self.user.id}: {str(e)}")
+            return 0
+
+        due = self._repos_due(repo_names)
+        claimed, in_progress = repo_sync_coordinator.claim(due)
+        try:
+            synced = self._sync_github_repos(github_service, [repo for repo in repos if repo.full_name in claimed])
+        finally:
+            repo_sync_coordinator.release(claimed)
+
+        # 他のユーザーが同期中のリポジトリは、保存が終わるのを待ってから計算に進む
+        repo_sync_coordinator.wait(in_progress, REPO_SYNC_WAIT_TIMEOUT)
+        logger.info(
+            f"GitHub sync for user {self.user.id}: {len(claimed)} repos fetched, "
+            f"{len(in_progress)} in progress elsewhere, {len(repo_names) - len(due)} recently synced"
+        )
+        return synced
+
+    def _repos_due(self, repo_names):
+        """同期が必要なリポジトリ（未同期・前回の同期から REPO_SYNC_INTERVAL 以上経過・バックフィルが残っている）"""
+        now = datetime.utcnow()
+        synced_after = now - timedelta(seconds=REPO_SYNC_INTERVAL)
+        backfill_start = now - timedelta(days=self.backfill_days)
+        stored = event_store.get_watermarks('github', repo_names)
+
+        due = set()
+        for repo_name in repo_names:
+            for kind in EVENT_KINDS:
+                watermark = stored.get((repo_name, kind))
+                backfill = stored.get((repo_name, kind + BACKFILL_SUFFIX))
+                if watermark is None or watermark.synced_at < synced_after or (
+                        backfill is not None and backfill.high_water_mark > backfill_start):
+                    due.add(repo_name)
+                    break
+        return due
+
+    def _sync_github_repos(self, github_service, repos):
+        """指定したリポジトリを差分同期し、続けてバックフィルする"""
+        if not repos:
+            return 0
+
+        try:
+            now = datetime.utcnow()
+            window_start = now - timedelta(days=self.window_days)
+            stored = event_store.get_watermarks('github', [repo.full_name for repo in repos])
+
+            watermarks = {}
+            for (repo_name, kind), watermark in stored.items():
+                if kind not in EVENT_KINDS:
+                    continue
+                overlap = DEPLOYMENT_STATUS_OVERLAP if kind == "deployments" else SYNC_OVERLAP
+                watermarks[(repo_name, kind)] = {
+                    "since": watermark.high_water_mark - overlap,
+                    "etag": watermark.etag,
+                    # 後から追加されたステータスは一覧のETagに現れないため、304でも直近の分は取り直す
+                    "recheck_since": now - DEPLOYMENT_STATUS_OVERLAP if kind == "deployments" else None
+                }
+
+            results = github_service.fetch_incremental_events(repos, watermarks, window_start, now)
+
+            synced = 0
+            for result in results:
+                if result["events"]:
+                    synced += event_store.save_github_events(result["repo"], result["kind"], result["events"])
+                previous = stored.get((result["repo"], result["kind"]))
+                # 304 の場合は since 以降を取得していないので同期済み位置を進めない（確認した時刻だけ更新する）
+                high_water_mark = now if result["changed"] or previous is None else previous.high_water_mark
+                event_store.set_watermark(
+                    'github', result["repo"], result["kind"], high_water_mark, result["etag"], watermark=previous
+                )
+                if (result["repo"], result["kind"]) not in watermarks and self.window_days < self.backfill_days:
+                    # 初回は集計期間の開始までしか取得していないので、残りをバックフィルに回す
+                    event_store.set_watermark('github', result["repo"], result["kind"] + BACKFILL_SUFFIX, window_start)
+            db.session.commit()
+
+            unchanged = sum(1 for result in results if not result["changed"])
+            pending = len(repos) * len(EVENT_KINDS) - len(results)
+            logger.info(
+                f"Synced {synced} GitHub events for user {self.user.id} "
+                f"({unchanged} listings not modified, {pending} deferred)"
+            )
+        except GithubException as e:
+            db.session.rollback()
+            logger.error(f"Error syncing GitHub events for user {self.user.id}: {str(e)}")
+            return 0
+
+        return synced + self._backfill_github(github_service, repos, now - timedelta(days=self.backfill_days))
+
+    def _backfill_github(self, github_service, repos, backfill_start):
+        """
+        集計期間より前のイベントを優先度を下げて取得します
+        レート制限の予算が少ないときは見送られ、取得できた範囲だけ進捗を記録して次回の同期で続きを取得する
+        """
+        repos_by_name = {repo.full_name: repo for repo in repos}
+        progress = {}
+        for (repo_name, resource), watermark in event_store.get_watermarks('github', repos_by_name).items():
+            if resource.endswith(BACKFILL_SUFFIX) and watermark.high_water_mark > backfill_start:
+                progress[(repo_name, resource[:-len(BACKFILL_SUFFIX)])] = watermark
+        if not progress:
+            return 0
+
+        ranges = [
+            (repos_by_name[repo_name], kind, backfill_start, watermark.high_water_mark)
+            for (repo_name, kind), watermark in progress.items()
+        ]
+        try:
+            with request_priority(PRIORITY_BACKFILL):
+                results = github_service.fetch_event_ranges(ranges)
+
+            synced = 0
+            for result in results:
+                if not result["complete"]:
+                    continue
+                synced += event_store.save_github_events(result["repo"], result["kind"], result["events"])
+                event_store.set_watermark(
+                    'github', result["repo"], result["kind"] + BACKFILL_SUFFIX, backfill_start,
+                    watermark=progress[(result["repo"], result["kind"])]
+                )
+            db.session.commit()
+
+            deferred = sum(1 for result in results if not result["complete"])
+            logger.info(f"Backfilled {synced} GitHub events for user {self.user.id} ({deferred} ranges deferred)")
+            return synced
+        except GithubException as e:
+            db.session.rollback()
+            logger.error(f"Error backfilling GitHub events for user {self.user.id}: {str(e)}")
+            return 0
+
+    def sync_jira(self):
+        """JiraのIssueを同期"""
+        jira_service = JiraService(self.user.jira_token)
+        if not jira_service.jira:
+            return 0
+
+        # JQLの結果はトークンごとに異なるため、同期済み位置はユーザー単位で持つ
+        scope = f"user:{self.user.id}"
+        try:
+            now = datetime.utcnow()
+            watermark = event_store.get_watermarks('jira', [scope]).get((scope, 'issues'))
+            since = watermark.high_water_mark - SYNC_OVERLAP if watermark else now - timedelta(days=self.backfill_days)
+
+            synced = 0
+            projects = set()
+            batch = []
+            # 初回は期間内に更新されていない未解決のIssueも取得する（以降は更新されたものだけで足りる）
+            for issue in jira_service.iter_updated_issues(since, include_unresolved=watermark is None):
+                batch.append(issue)
+                if len(batch) >= JIRA_SAVE_BATCH_SIZE:
+                    projects.update(event_store.save_jira_issues(batch))
+                    synced += len(batch)
+                    batch = []
+            if batch:
+                projects.update(event_store.save_jira_issues(batch))
+                synced += len(batch)
+
+            event_store.set_watermark('jira', scope, 'issues', now, watermark=watermark)
+            event_store.set_scope_access(self.user.id, 'jira', projects)
+            db.session.commit()
+
+            logger.info(f"Synced {synced} Jira issues for user {self.user.id}")
+            return synced
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error syncing Jira issues for user {self.user.id}: {str(e)}")
+            return 0
+
+def sync_and_compute_metrics(user_id, source, window_days=30, record=True):
+    """
+    ローカルストアを差分同期してからメトリクスを計算します
+    アプリケーションコンテキスト内で呼び出すこと
+    record=False の場合は履歴に保存しない（バッチ処理で呼び出し元がまとめて保存する）
+    """
+    user = db.session.get(User, user_id)
+    started = datetime.utcnow()
+    with registry.timer("sync_duration_seconds", source=source):
+        EventSyncService(user, window_days=window_days).sync(source)
+    # 比較用の集計期間（METRIC_WINDOWS）の値も同じ集計で計算する
+    metrics = event_store.compute_metrics(user_id, source, window_days)
+
+    # トークンが設定されているソースだけ履歴に残す
+    token = user.github_token if source == 'github' else user.jira_token
+    if token:
+        if record:
+            metric_history.record_metrics(user_id, source, metrics)
+            db.session.commit()
+
+        # 同期できなかったスコープがあれば、保存済みのデータによる部分的な結果であることを示す
+        # （REPO_SYNC_INTERVAL 以内に他のユーザーの同期で取得済みのものは最新とみなす）
+        metrics["freshness"] = event_store.get_freshness(
+            user_id, source, started - timedelta(seconds=REPO_SYNC_INTERVAL)
+        )
+    return metrics
@@ -0,0 +1,170 @@
+import os
+import hmac
+import hashlib
+import logging
+from datetime import datetime, timezone
+import requests
+from jira import JIRAError
+from app import db
+from models import User
+from services import event_store
+from services.instrumentation import registry
+from services.jira_service import JiraService
+
+logger = logging.getLogger(__name__)
+
+# Webhookの署名検証に使う共有シークレット（未設定のソースのWebhookは受け付けない）
+GITHUB_WEBHOOK_SECRET = os.environ.get('GITHUB_WEBHOOK_SECRET')
+JIRA_WEBHOOK_SECRET = os.environ.get('JIRA_WEBHOOK_SECRET')
+
+# incident として扱う Issue のラベル（同期と同じ）
+INCIDENT_LABEL = "incident"
+
+# デプロイメントの失敗とみなすステータス（同期と同じ）
+FAILED_DEPLOYMENT_STATE = "failure"
+
+JIRA_DELETED_EVENTS = ("jira:issue_deleted",)
+
+def verify_signature(secret, body, signature):
+    """
+    X-Hub-Signature-256（GitHub）/ X-Hub-Signature（Jira）の HMAC-SHA256 署名を検証
+    signature: "sha256=<16進数>"
+    """
+    if not secret or not signature or not signature.startswith("sha256="):
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature[len("sha256="):])
+
+def _parse_github_datetime(value):
+    """GitHubの日時（例: 2024-01-01T10:00:00Z）を naive UTC に変換"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _deployment_status(repo, payload):
+    deployment = payload["deployment"]
+    previous = event_store.get_github_event(repo, "deployments", deployment["id"])
+    failed = payload["deployment_status"]["state"] == FAILED_DEPLOYMENT_STATE
+    return "deployments", deployment["id"], {
+        "repo": repo,
+        "id": deployment["id"],
+        "created_at": _parse_github_datetime(deployment["created_at"]),
+        # いずれかのステータスが失敗なら失敗したデプロイメントとする
+        "failed": failed or bool(previous and previous["failed"])
+    }
+
+def _pull_request(repo, payload):
+    pr = payload["pull_request"]
+    if payload["action"] != "closed" or not pr.get("merged_at"):
+        return None
+    return "pull_requests", pr["number"], {
+        "repo": repo,
+        "number": pr["number"],
+        "created_at": _parse_github_datetime(pr["created_at"]),
+        "merged_at": _parse_github_datetime(pr["merged_at"])
+    }
+
+def _issue(repo, payload):
+    issue = payload["issue"]
+    if payload["action"] not in ("labeled", "unlabeled", "closed", "reopened", "deleted"):
+        return None
+    is_incident = any(label["name"] == INCIDENT_LABEL for label in issue.get("labels", []))
+    if payload["action"] in ("labeled", "unlabeled") and payload.get("label", {}).get("name") != INCIDENT_LABEL:
+        return None
+    if not is_incident and payload["action"] not in ("unlabeled", "deleted"):
+        return None
+
+    # 同期と同じく、クローズ済みの incident Issue だけを集計対象にする
+    if payload["action"] == "deleted" or not is_incident or not issue.get("closed_at"):
+        return "incidents", issue["number"], None
+    return "incidents", issue["number"], {
+        "repo": repo,
+        "number": issue["number"],
+        "created_at": _parse_github_datetime(issue["created_at"]),
+        "closed_at": _parse_github_datetime(issue["closed_at"])
+    }
+
+GITHUB_HANDLERS = {
+    "deployment_status": _deployment_status,
+    "pull_request": _pull_request,
+    "issues": _issue
+}
+
+def handle_github_event(event_name, payload):
+    """
+    GitHubのWebhookイベントを保存済みのイベントと集計に反映します
+    反映した場合はリポジトリ名を返す（対象外のイベントは None）
+    """
+    handler = GITHUB_HANDLERS.get(event_name)
+    if handler is None or "repository" not in payload:
+        registry.inc("webhook_events_total", source='github', event=event_name, result="ignored")
+        return None
+
+    repo = payload["repository"]["full_name"]
+    try:
+        parsed = handler(repo, payload)
+        if parsed is None:
+            registry.inc("webhook_events_total", source='github', event=event_name, result="ignored")
+            return None
+        kind, external_id, event = parsed
+        changed = event_store.apply_github_event(repo, kind, external_id, event)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        registry.inc("webhook_events_total", source='github', event=event_name, result="error")
+        raise
+
+    registry.inc("webhook_events_total", source='github', event=event_name, result="applied" if changed else "unchanged")
+    logger.info(f"Applied GitHub {event_name} webhook for {repo} ({kind} {external_id}, changed={changed})")
+    return repo if changed else None
+
+def handle_jira_event(payload):
+    """
+    JiraのWebhookイベント（Issueの作成・更新・削除）を保存済みのIssueに反映します
+    反映した場合はプロジェクトキーを返す（対象外のイベントは None）
+    """
+    event_name = payload.get("webhookEvent", "")
+    if not event_name.startswith("jira:issue_") or "issue" not in payload:
+        registry.inc("webhook_events_total", source='jira', event=event_name, result="ignored")
+        return None
+
+    try:
+        issue = JiraService._to_issue_event(payload["issue"])
+        deleted = event_name in JIRA_DELETED_EVENTS
+        if not deleted and issue["resolved_at"] is None and issue["status_category"] == 'done':
+            _fill_resolved_at(issue)
+        project = event_store.apply_jira_issue(issue, deleted=deleted)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        registry.inc("webhook_events_total", source='jira', event=event_name, result="error")
+        raise
+
+    registry.inc("webhook_events_total", source='jira', event=event_name, result="applied")
+    logger.info(f"Applied Jira {event_name} webhook for {issue['key']}")
+    return project
+
+def _fill_resolved_at(issue):
+    """
+    解決日時のない完了済みIssueは、同期と同じく変更履歴から完了ステータスへの最後の遷移日時を補う
+    プロジェクトを参照できるユーザーのトークンで問い合わせ、できなければ次の同期で取得し直す
+    """
+    user_ids = event_store.get_scope_users('jira', issue["project"])
+    users = User.query.filter(User.id.in_(user_ids), User.jira_token.isnot(None)).all() if user_ids else []
+    for user in users:
+        jira_service = JiraService(user.jira_token)
+        if not jira_service.jira:
+            continue
+        try:
+            jira_service._fill_resolved_from_changelog([issue])
+            return
+        except (JIRAError, requests.exceptions.RequestException) as e:
+            logger.warning(f"Error looking up Jira changelog for {issue['key']} with user {user.id}: {str(e)}")
+
+    logger.warning(f"Could not look up resolution time for {issue['key']}, marking it for resync")
+    event_store.rewind_watermarks(
+        'jira', [f"user:{user_id}" for user_id in user_ids], 'issues', issue["updated_at"] or datetime.utcnow()
+    )
@@ -2,6 +2,7 @@ document.addEventListener('DOMContentLoaded', function() {
     initializeCharts();
     initializePreferences();
     setupDragAndDrop();
+    connectMetricsStream();
 });
 
 let charts = {};
@@ -9,6 +10,25 @@ let charts = {};
 function initializeCharts() {
     charts.github = createChart('githubMetricsChart', window.githubMetrics, userPreferences.chart_type);
     charts.jira = createChart('jiraMetricsChart', window.jiraMetrics, userPreferences.chart_type);
+    loadJiraHistory();
+    renderWindows('github', window.githubMetrics.windows);
+    renderWindows('jira', window.jiraMetrics.windows);
+}
+
+// Weekly values for the Jira chart come from the history API
+async function loadJiraHistory() {
+    try {
+        const params = new URLSearchParams({
+            source: 'jira', metric: 'ticket_completion_rate', days: 28, points: 4
+        });
+        const response = await fetch(`/api/metrics/history?${params}`);
+        const history = await response.json();
+        window.jiraHistory = history.points.map(point => point.value);
+        charts.jira.data.datasets[0].data = window.jiraHistory;
+        charts.jira.update();
+    } catch (error) {
+        console.error('Failed to load metrics history:', error);
+    }
 }
 
 function createChart(canvasId, data, type = 'bar') {
@@ -30,7 +50,7 @@ function getChartConfig(data, type) {
                 data: isGithub 
                     ? [data.deployment_frequency.value, data.lead_time.value, 
                        data.change_failure_rate.value, data.time_to_restore.value]
-                    : data || [],
+                    : window.jiraHistory || [],
                 backgroundColor: isGithub 
                     ? 'rgba(54, 162, 235, 0.2)'
                     : 'rgba(75, 192, 192, 0.2)',
@@ -72,13 +92,13 @@ function initializePreferences() {
     });
 
     // Refresh interval
-    document.getElementById('refreshInterval').addEventListener('change', function(e) {
-        setupRefreshInterval(parseInt(e.target.value));
-        savePreferences();
+    // The server reads the interval when the stream connects, so reconnect after saving
+    document.getElementById('refreshInterval').addEventListener('change', async function(e) {
+        await savePreferences();
+        connectMetricsStream();
     });
 
     // Initial setup
-    setupRefreshInterval(userPreferences.refresh_interval);
     if (userPreferences.theme === 'dark') {
         document.body.className = 'dark-theme';
     }
@@ -102,23 +122,114 @@ function updateChartType(type) {
     });
 }
 
-function setupRefreshInterval(interval) {
-    if (window.refreshTimer) {
-        clearInterval(window.refreshTimer);
+// Metrics are pushed by the server over Server-Sent Events (recomputed once per user, shared across tabs)
+function connectMetricsStream() {
+    if (window.metricsStream) {
+        window.metricsStream.close();
     }
-    window.refreshTimer = setInterval(refreshData, interval * 1000);
+    window.metricsStream = new EventSource('/api/metrics/stream');
+    window.metricsStream.addEventListener('metrics', function(e) {
+        const message = JSON.parse(e.data);
+        updateMetrics(message.source, message.metrics);
+    });
 }
 
-async function refreshData() {
-    try {
-        const response = await fetch('/api/metrics/refresh');
-        const data = await response.json();
-        window.githubMetrics = data.github_metrics;
-        window.jiraMetrics = data.jira_metrics;
-        updateChartType(document.getElementById('chartType').value);
-    } catch (error) {
-        console.error('Failed to refresh metrics:', error);
+function updateMetrics(source, metrics) {
+    window[`${source}Metrics`] = metrics;
+    const chart = charts[source];
+    if (source === 'github') {
+        chart.data.datasets[0].data = [
+            metrics.deployment_frequency.value, metrics.lead_time.value,
+            metrics.change_failure_rate.value, metrics.time_to_restore.value
+        ];
+        chart.update();
+    } else {
+        loadJiraHistory();
+    }
+    renderMetricsList(source, metrics);
+    renderFreshness(source, metrics.freshness);
+    renderWindows(source, metrics.windows);
+    document.getElementById(`${source}Loading`).hidden = !metrics.loading;
+}
+
+function formatValue(metric) {
+    return metric.value === null || metric.value === undefined ? '—' : metric.value;
+}
+
+function formatPercentiles(metric) {
+    return metric.p90 !== undefined ? ` (p50 ${metric.p50} / p90 ${metric.p90})` : '';
+}
+
+function renderMetricsList(source, metrics) {
+    const items = source === 'github'
+        ? [
+            `Deployment Frequency: ${formatValue(metrics.deployment_frequency)} ${metrics.deployment_frequency.unit}`,
+            `Lead Time: ${formatValue(metrics.lead_time)} ${metrics.lead_time.unit}${formatPercentiles(metrics.lead_time)}`,
+            `Change Failure Rate: ${formatValue(metrics.change_failure_rate)}${metrics.change_failure_rate.unit}`,
+            `Time to Restore: ${formatValue(metrics.time_to_restore)} ${metrics.time_to_restore.unit}${formatPercentiles(metrics.time_to_restore)}`
+        ]
+        : [
+            `Completion Rate: ${formatValue(metrics.ticket_completion_rate)}${metrics.ticket_completion_rate.unit}`,
+            `Average Resolution Time: ${formatValue(metrics.average_resolution_time)} ${metrics.average_resolution_time.unit}`,
+            `Backlog Health: ${formatValue(metrics.backlog_health)}`
+        ];
+    const list = document.getElementById(`${source}MetricsList`);
+    list.replaceChildren(...items.map(text => {
+        const item = document.createElement('li');
+        item.textContent = text;
+        return item;
+    }));
+}
+
+const WINDOW_METRIC_LABELS = {
+    github: {
+        deployment_frequency: 'Deployment Frequency',
+        lead_time: 'Lead Time',
+        change_failure_rate: 'Change Failure Rate',
+        time_to_restore: 'Time to Restore'
+    },
+    jira: {
+        ticket_completion_rate: 'Completion Rate',
+        average_resolution_time: 'Average Resolution Time',
+        backlog_health: 'Backlog Health'
+    }
+};
+
+// Compare values side by side for each window (7, 30, 90 days, ...)
+function renderWindows(source, windows) {
+    const table = document.getElementById(`${source}Windows`);
+    if (!windows) {
+        table.hidden = true;
+        return;
+    }
+    const days = Object.keys(windows).sort((a, b) => a - b);
+    const header = document.createElement('tr');
+    header.replaceChildren(...['', ...days.map(d => `${d}d`)].map(text => {
+        const cell = document.createElement('th');
+        cell.textContent = text;
+        return cell;
+    }));
+    const rows = Object.entries(WINDOW_METRIC_LABELS[source]).map(([metricType, label]) => {
+        const row = document.createElement('tr');
+        row.replaceChildren(...[label, ...days.map(d => formatValue(windows[d][metricType]))].map(text => {
+            const cell = document.createElement('td');
+            cell.textContent = text;
+            return cell;
+        }));
+        return row;
+    });
+    table.replaceChildren(header, ...rows);
+    table.hidden = false;
+}
+
+function renderFreshness(source, freshness) {
+    const element = document.getElementById(`${source}Freshness`);
+    if (!freshness || freshness.status === 'fresh') {
+        element.hidden = true;
+        return;
     }
+    element.textContent = `Partial data (last synced ${freshness.as_of || 'never'}, ${freshness.pending} pending)`;
+    element.hidden = false;
 }
 
 async function savePreferences() {
@@ -2,25 +2,78 @@ document.addEventListener('DOMContentLoaded', function() {
     const markdownInput = document.getElementById('markdownInput');
     const preview = document.getElementById('preview');
 
+    // The server keeps the document so that later previews only send the changed lines
+    const documentId = window.crypto && crypto.randomUUID
+        ? crypto.randomUUID()
+        : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    let sentLines = null;
+    let revision = null;
+    let sending = false;
+    let queued = false;
+
+    // Replace the lines between the common prefix and the common suffix
+    function diffLines(oldLines, newLines) {
+        let start = 0;
+        while (start < oldLines.length && start < newLines.length && oldLines[start] === newLines[start]) {
+            start++;
+        }
+        let end = 0;
+        while (end < oldLines.length - start && end < newLines.length - start
+               && oldLines[oldLines.length - 1 - end] === newLines[newLines.length - 1 - end]) {
+            end++;
+        }
+        return {
+            start: start,
+            delete: oldLines.length - start - end,
+            lines: newLines.slice(start, newLines.length - end)
+        };
+    }
+
     function updatePreview() {
-        const markdown = markdownInput.value;
+        // Wait for the previous response: the next diff is based on its revision
+        if (sending) {
+            queued = true;
+            return;
+        }
+        sending = true;
+
+        const lines = markdownInput.value.split('\n');
+        const body = sentLines === null
+            ? { document_id: documentId, content: markdownInput.value }
+            : { document_id: documentId, revision: revision, changes: [diffLines(sentLines, lines)] };
+
         fetch('/api/preview_markdown', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ content: markdown })
+            body: JSON.stringify(body)
         })
         .then(response => response.json())
         .then(data => {
-            if (data.error) {
+            if (data.resync) {
+                // The server no longer has our revision, send the whole document again
+                sentLines = null;
+                queued = true;
+            } else if (data.error) {
+                sentLines = null;
                 preview.innerHTML = `<div class="alert alert-danger">${data.error}</div>`;
             } else {
+                sentLines = lines;
+                revision = data.revision;
                 preview.innerHTML = data.html;
             }
         })
         .catch(error => {
+            sentLines = null;
             preview.innerHTML = `<div class="alert alert-danger">Error: ${error.message}</div>`;
+        })
+        .finally(() => {
+            sending = false;
+            if (queued) {
+                queued = false;
+                updatePreview();
+            }
         });
     }
 
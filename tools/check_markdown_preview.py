@@ -0,0 +1,99 @@
+"""
+READMEプレビューのブロックごとの描画が、文書全体を一度に描画した結果と同じになるか確認する
+
+閉じない HTML・URL の無い参照リンクの定義・閉じないフェンスなどを含む文書と、
+断片を組み合わせたランダムな文書を両方の方法で描画し、違いがあれば終了コード1で終了する。
+
+    python tools/check_markdown_preview.py
+    python tools/check_markdown_preview.py --documents 50000 --seed 3
+"""
+import argparse
+import os
+import random
+import re
+import sys
+
+import markdown
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.markdown_preview import MARKDOWN_EXTENSIONS, MarkdownRenderer
+
+CASES = [
+    "para text\n[r]: http://x\n- item\n\n[r2]:\n<details>",
+    "intro [x]\n\n<details>\n<summary>More</summary>\n\nhidden *text*\n\n</details>\n\n[x]: http://e.com",
+    "a [r]\n\n<div>\n\nnever closed\n\n[r]: http://x",
+    "a [r]\n\n<!--\ncomment\n\n[r]: http://x",
+    "text <!-- inline\n\nstill -->\n\nmore",
+    "see [x] and [y]\n\n[x]: http://e.com\n    \"Title X\"\n\n[y]:\n  http://f.com\n  'Title Y'",
+    "[r]:\n\n[r]:\n```\ncode\n```\n\nuse [r]",
+    "[r]:\n~~~\n\n[r]\n\n```\nnever closed",
+    "use [r]\n\n[r]: http://a\n\n[r]: http://b",
+    "- item [r]\n\n[r]: http://x\n\n  continued",
+    "> quote [r]\n> [r]: http://x\n\n> more",
+    "| a | b |\n|---|---|\n[r]: http://x\n\nuse [r]",
+    "use [r]\n\n[r]:\n***\n\n[r]:\n> quote",
+    "<div>\n<!--\n</div>\n\n[r]: http://x\n\nuse [r]",
+    "<div>\n<!--\n</div>\n-->\n\n| a | b |\n|---|---|",
+    "> ***\n[r]:\n> q\n\nuse [r]",
+    "> a\n```\nc\n```\n[r]:\n> q\n\nuse [r]",
+]
+
+# ランダムな文書の断片
+PIECES = [
+    "para text", "para [r] [r2]", "[r]: http://x", "[r2]:", "  http://y", "  \"T\"", "- item", "  cont", "> q",
+    "> | a | b |", "> |---|---|", "> [r]: http://z", ">", "> # H", "> ***", "```", "~~~", "code", "<details>",
+    "</details>", "<div>", "</div>", "<!--", "-->", "| a | b |", "|---|---|", "# H", "    ind", "***", "", "", "",
+]
+
+def normalize(html):
+    """ブロックの区切りで入る空白の違いを無視する"""
+    return re.sub(r'>\s+<', '><', html.strip())
+
+def balanced_comments(lines):
+    """
+    コメントの開始・終了が対応しているか
+    対応しない場合の markdown の出力は前にある空行の有無でも変わるため、ランダムな文書からは除く
+    """
+    opened = False
+    for line in lines:
+        if line == "<!--":
+            if opened:
+                return False
+            opened = True
+        elif line == "-->":
+            if not opened:
+                return False
+            opened = False
+    return not opened
+
+def random_documents(count, seed):
+    generator = random.Random(seed)
+    while count:
+        lines = [generator.choice(PIECES) for _ in range(generator.randint(1, 14))]
+        if balanced_comments(lines):
+            count -= 1
+            yield "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that block-wise Markdown preview matches a full render")
+    parser.add_argument("--documents", type=int, default=20000, help="number of random documents")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--show", type=int, default=5, help="number of mismatches to print")
+    args = parser.parse_args()
+
+    converter = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+    renderer = MarkdownRenderer()
+    mismatches = 0
+    for text in CASES + list(random_documents(args.documents, args.seed)):
+        expected = converter.reset().convert(text)
+        actual = renderer.render(text.split("\n"))
+        if normalize(actual) != normalize(expected):
+            mismatches += 1
+            if mismatches <= args.show:
+                print(f"MISMATCH {text!r}\n--- full\n{expected}\n--- blocks\n{actual}\n")
+    print(f"{len(CASES) + args.documents} documents, {mismatches} mismatches")
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
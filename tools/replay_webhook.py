@@ -0,0 +1,58 @@
+"""
+記録したWebhookのペイロードをローカルのサーバーへ送信する
+
+GITHUB_WEBHOOK_SECRET / JIRA_WEBHOOK_SECRET と同じシークレットで署名し、
+GitHub / Jira が送るのと同じヘッダーを付けて POST する。
+
+    python tools/replay_webhook.py github pull_request tools/webhook_payloads/github_pull_request_merged.json
+    python tools/replay_webhook.py jira - tools/webhook_payloads/jira_issue_updated.json --url http://localhost:5000
+"""
+import argparse
+import hashlib
+import hmac
+import os
+import sys
+import uuid
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+def build_request(url, source, event_name, body, secret):
+    """署名付きのWebhookリクエストを作る"""
+    signature = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    headers = {"Content-Type": "application/json"}
+    if source == "github":
+        headers.update({
+            "X-GitHub-Event": event_name,
+            "X-GitHub-Delivery": str(uuid.uuid4()),
+            "X-Hub-Signature-256": signature
+        })
+    else:
+        headers["X-Hub-Signature"] = signature
+    return Request(f"{url}/webhooks/{source}", data=body, headers=headers, method="POST")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded GitHub or Jira webhook payload")
+    parser.add_argument("source", choices=("github", "jira"))
+    parser.add_argument("event", help="GitHub event name (X-GitHub-Event); ignored for Jira")
+    parser.add_argument("payload", help="path to the recorded JSON payload")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--secret", help="defaults to GITHUB_WEBHOOK_SECRET / JIRA_WEBHOOK_SECRET")
+    args = parser.parse_args()
+
+    secret = args.secret or os.environ.get(f"{args.source.upper()}_WEBHOOK_SECRET")
+    if not secret:
+        print(f"Set {args.source.upper()}_WEBHOOK_SECRET or pass --secret", file=sys.stderr)
+        return 2
+
+    with open(args.payload, "rb") as f:
+        body = f.read()
+    try:
+        with urlopen(build_request(args.url, args.source, args.event, body, secret)) as response:
+            print(response.status, response.read().decode())
+    except HTTPError as e:
+        print(e.code, e.read().decode())
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())